@@ -1,4 +1,6 @@
-import json, logging, inspect, functools
+import base64, json, logging, inspect, functools
+
+_log = logging.getLogger('api')
 
 #分页 提供数据总数和分页大小 并指定第几页 然后Page就会计算sql的 offset和limit 并且判断是否有下一页或上一页
 class Page(object):
@@ -17,6 +19,28 @@ class Page(object):
             self.limit = self.page_size #offset和limit主要是用来提供给 sql语句进行分页查询的
         self.has_next = self.page_index < self.page_count
         self.has_previous = self.page_index > 1
+        self.next_cursor = None     #keyset分页用的游标 见set_cursors()
+        self.previous_cursor = None
+
+    #keyset分页 按游标查出来的一页 没有页码 direction是游标的方向 has_more表示这个方向上还有没有数据
+    @classmethod
+    def seek(cls, item_count, direction, has_more, first_key=None, last_key=None, page_size=5):
+        p = cls(item_count, 1, page_size)
+        p.page_index = None
+        p.offset = None
+        p.limit = page_size
+        #能拿到游标 说明游标那一条的另一边肯定还有数据
+        p.has_next = has_more if direction == 'next' else True
+        p.has_previous = has_more if direction == 'prev' else True
+        p.set_cursors(first_key, last_key)
+        return p
+
+    #first_key/last_key是这一页第一条和最后一条记录的排序键 客户端拿着游标翻页 查询不需要offset
+    def set_cursors(self, first_key, last_key):
+        if first_key is None or last_key is None:
+            return
+        self.next_cursor = encode_cursor('next', last_key) if self.has_next else None
+        self.previous_cursor = encode_cursor('prev', first_key) if self.has_previous else None
 
     def __str__(self):
         return 'item_count: %s, page_count: %s, page_index: %s, page_size: %s, offset: %s, limit: %s' \
@@ -53,4 +77,73 @@ class APIPermissionError(APIError):
     Indicate the api has no permission.
     '''
     def __init__(self, message=''):
-        super(APIPermissionError, self).__init__('permission:forbidden', 'permission', message)
\ No newline at end of file
+        super(APIPermissionError, self).__init__('permission:forbidden', 'permission', message)
+#游标对客户端是不透明的字符串 内容是方向加上记录的排序键 比如['next', created_at, id]
+def encode_cursor(direction, key):
+    data = json.dumps([direction] + list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+#返回(direction, key) 游标不合法就抛APIValueError
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        if not isinstance(data, list) or len(data) < 2 or data[0] not in ('next', 'prev'):
+            raise ValueError('bad cursor: %s' % cursor)
+    except (ValueError, TypeError):
+        raise APIValueError('cursor', 'Invalid cursor.')
+    return data[0], tuple(data[1:])
+
+#api返回值的json序列化 直接输出utf-8的bytes
+#Model是dict的子类 两个后端都按dict原生处理 其余对象先找注册的编码函数 没有就用它的__dict__(以前的行为)
+_encoders = {}
+
+def register_encoder(cls, encoder):
+    _encoders[cls] = encoder
+
+def _default(o):
+    encoder = _encoders.get(type(o))
+    if encoder is None:
+        for cls in type(o).__mro__[1:]:    #子类用父类的编码函数 找到一次就记下来
+            encoder = _encoders.get(cls)
+            if encoder is not None:
+                _encoders[type(o)] = encoder
+                break
+        else:
+            return o.__dict__
+    return encoder(o)
+
+register_encoder(Page, vars)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, default=_default)
+
+def _json_dumps(obj):
+    return _json_encoder.encode(obj).encode('utf-8')
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_default)
+
+_dumps = _orjson_dumps if orjson is not None else _json_dumps
+
+#别的模块from apis import json_dumps 所以换后端只换里面的_dumps
+def json_dumps(obj):
+    return _dumps(obj)
+
+#backend: 'auto'有orjson就用orjson 'orjson' 'json'(标准库) 或者一个obj => bytes的函数
+def set_json_backend(backend='auto'):
+    global _dumps
+    if callable(backend):
+        _dumps = backend
+    elif backend == 'orjson' or (backend == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ValueError('orjson is not installed')
+        _dumps = _orjson_dumps
+    elif backend in ('auto', 'json'):
+        _dumps = _json_dumps
+    else:
+        raise ValueError('Invalid json backend: %s' % backend)
+    _log.info('json backend: %s', getattr(_dumps, '__name__', _dumps))
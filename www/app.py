@@ -1,15 +1,21 @@
-import logging; logging.basicConfig(level=logging.INFO)
-import asyncio, os, json, time
+import logging
+import asyncio, os, time
 from aiohttp import web
 from datetime import datetime
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
 from coreweb import *
-import orm
+from apis import APIPermissionError, json_dumps, set_json_backend
+import assets, compress, log, orm, pagecache, render
 from handlers import cookie2user, COOKIE_NAME
 from config import configs
 
+#每个请求都要记的日志分到access和auth两个子系统 可以单独调级别或者采样 见config的logging
+_access_log = logging.getLogger('access')
+_auth_log = logging.getLogger('auth')
+_template_log = logging.getLogger('templates')
+
 #def index(request):
 	#return web.Response(body=b'<h1>Awesome</h1>', content_type='text/html')
 
@@ -21,8 +27,15 @@ def init_jinja2(app, **kw):
         block_end_string = kw.get('block_end_string', '%}'),
         variable_start_string = kw.get('variable_start_string', '{{'),	#定义html中如何写变量
         variable_end_string = kw.get('variable_end_string', '}}'),
-        auto_reload = kw.get('auto_reload', True)
+        auto_reload = kw.get('auto_reload', True)	#每次get_template都检查模板文件有没有改过 生产环境关掉
     )
+    #编译好的模板存到磁盘 重启后不用再编译 True用jinja2默认的临时目录 也可以指定目录
+    bytecode_cache = kw.get('bytecode_cache', None)
+    if bytecode_cache is True:
+        options['bytecode_cache'] = FileSystemBytecodeCache()
+    elif bytecode_cache:
+        os.makedirs(bytecode_cache, exist_ok=True)
+        options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_cache)
     path = kw.get('path', None)
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')	#模板所在路径
@@ -32,8 +45,42 @@ def init_jinja2(app, **kw):
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f
+    env.globals['static_url'] = assets.static_url     #{{ static_url('css/awesome.css') }} 生成带指纹的url
+    if kw.get('preload', False):
+        preload_templates(env)
     app['__templating__'] = env
 
+#启动时编译所有模板放进env的缓存 第一个请求就不用等编译了 有bytecode cache时直接从磁盘读编译结果
+def preload_templates(env):
+    start = time.perf_counter()
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    _template_log.info('preload %s templates in %.1fms', len(names), (time.perf_counter() - start) * 1000)
+
+#每个模板的渲染次数 总用时 最长用时(秒) 超过slow_ms的渲染记一条warning
+_template_stats = {}
+_slow_render = configs.templates.slow_ms / 1000
+
+def render_template(env, name, kw):
+    template = env.get_template(name)
+    start = time.perf_counter()
+    html = template.render(**kw)
+    t = time.perf_counter() - start
+    stats = _template_stats.get(name)
+    if stats is None:
+        stats = _template_stats[name] = [0, 0.0, 0.0]
+    stats[0] += 1
+    stats[1] += t
+    if t > stats[2]:
+        stats[2] = t
+    if t > _slow_render:
+        _template_log.warning('render %s took %.1fms', name, t * 1000)
+    return html
+
+def template_stats():
+    return dict((name, dict(count=n, avg_ms=total / n * 1000, max_ms=longest * 1000)) for name, (n, total, longest) in _template_stats.items())
+
 #计算传入的时间是多久之前 jinja2的filter
 def datetime_filter(t):
     delta = int(time.time() - t)
@@ -48,49 +95,118 @@ def datetime_filter(t):
     dt = datetime.fromtimestamp(t)
     return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
-#拦截器-日志
+#拦截器-日志 认证策略是none的路由(静态文件)不记录
 async def logger_factory(app, handler):
 	async def logger(request):
 		# 记录日志:
-		logging.info('Request: %s %s' % (request.method, request.path))
+		if route_auth(request) != 'none':
+			_access_log.info('Request: %s %s', request.method, request.path)
 		# 继续处理请求:
 		return (await handler(request))
 	return logger
 
+#拦截器-identity map 同一个请求里重复Model.find(pk)同一行只查一次数据库
+async def identity_map_factory(app, handler):
+    async def identity_map(request):
+        with orm.identity_map():
+            return (await handler(request))
+    return identity_map
+
 #拦截器-解析cookie 把里面的user绑定到request上 cookie验证的逻辑：
 #每个url请求都去验证cookie 如果cookie有效 再从cookie中解析user 因为每个url都要做 所以写成拦截器
+#认证策略是none的路由直接跳过 required的路由没登录就拦下来
 async def auth_factory(app, handler):
     async def auth(request):
-        logging.info('check user: %s %s' % (request.method, request.path))
         request.__user__ = None
+        policy = route_auth(request)
+        if policy == 'none':
+            return (await handler(request))
+        _auth_log.debug('check user: %s %s', request.method, request.path)
         cookie_str = request.cookies.get(COOKIE_NAME) #获取cookie
         if cookie_str:
             user = await cookie2user(cookie_str)
             if user:
-                logging.info('set current user: %s' % user.email)
+                _auth_log.info('set current user: %s', user.email)
                 request.__user__ = user
         if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):    #如果访问/manage/ 检查身份是否为管理员
             return web.HTTPFound('/signin')
+        if policy == 'required' and request.__user__ is None:
+            if request.path.startswith('/api/'):
+                e = APIPermissionError('Please signin first.')
+                resp = web.Response(body=json_dumps(dict(error=e.error, data=e.data, message=e.message)))
+                resp.content_type = 'application/json;charset=utf-8'
+                return resp
+            return web.HTTPFound('/signin')
         return (await handler(request))
     return auth
 
+#拦截器-压缩响应 按Accept-Encoding用br或gzip压缩response_factory生成的html/json
+#已经压缩过的(静态文件的.gz)和流式响应不管 带强ETag的响应压缩后改成弱ETag 因为body不再是同一份字节了
+async def compression_factory(app, handler):
+    async def compression(request):
+        r = await handler(request)
+        if r.status == 304:     #浏览器拿压缩过的版本的弱ETag来确认 回复同样的弱ETag
+            etag = r.headers.get('ETag')
+            if etag and ('W/' + etag) in request.headers.get('If-None-Match', ''):
+                r.headers['ETag'] = 'W/' + etag
+            return r
+        if type(r) is not web.Response or r.status != 200 or not isinstance(r.body, bytes) or 'Content-Encoding' in r.headers:
+            return r
+        if not compress.compressible(r.content_type, len(r.body)):
+            return r
+        vary = r.headers.get('Vary')
+        r.headers['Vary'] = vary + ', Accept-Encoding' if vary else 'Accept-Encoding'
+        encoding = compress.negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return r
+        etag = r.headers.get('ETag')
+        r.body = await compress.compress_body(r.body, encoding, etag)
+        r.headers['Content-Encoding'] = encoding
+        if etag and not etag.startswith('W/'):
+            r.headers['ETag'] = 'W/' + etag
+        return r
+    return compression
+
+#拦截器-整页缓存 匿名用户GET @get(cache=True)的页面 命中就直接返回编码好的body
+#响应都带强ETag 浏览器带If-None-Match再来时 内容没变就回304 不用再传body
+#必须放在auth后面(要知道有没有登录) response_factory前面(要拿到编码好的body)
+async def page_cache_factory(app, handler):
+    async def page_cache(request):
+        if request.method != 'GET' or request.__user__ is not None or not route_cache(request):
+            return (await handler(request))
+        query = route_cache_query(request)
+        entry = pagecache.get(request.path, query)
+        if entry is None:
+            version = pagecache.version()
+            r = await handler(request)
+            if type(r) is not web.Response or r.status != 200 or not isinstance(r.body, bytes):
+                return r
+            entry = pagecache.put(request.path, query, r.body, r.headers['Content-Type'], version)
+        body, etag, content_type, expires = entry
+        #登录用户看到的页面不一样 所以按Cookie区分 no-cache让浏览器每次都带ETag来确认
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Cookie'}
+        if pagecache.not_modified(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers=headers)
+        headers['Content-Type'] = content_type
+        return web.Response(body=body, headers=headers)
+    return page_cache
+
 #拦截器-解析数据到__data__
 async def data_factory(app, handler):
     async def parse_data(request):
         if request.method == 'POST':
             if request.content_type.startswith('application/json'):
                 request.__data__ = await request.json()
-                logging.info('request json: %s' % str(request.__data__))
+                _access_log.debug('request json: %s', request.__data__)
             elif request.content_type.startswith('application/x-www-form-urlencoded'):
                 request.__data__ = await request.post()
-                logging.info('request form: %s' % str(request.__data__))
+                _access_log.debug('request form: %s', request.__data__)
         return (await handler(request))
     return parse_data
 
 #拦截器-把返回值转换为web.Response对象再返回，以保证满足aiohttp的要求
 async def response_factory(app, handler):
     async def response(request):
-        logging.info('Response handler... ')
         r = await handler(request)  #拦截器的概念 request的时候到这里，当response后，接着执行下面的语句 和java中的一模一样
         if isinstance(r, web.StreamResponse):   #web.Response()是web.StreamResponse类型对象 所以如果自己返回了web.Response()就不用处理了。
             return r
@@ -107,12 +223,12 @@ async def response_factory(app, handler):
         if isinstance(r, dict):
             template = r.get('__template__')
             if template is None:    #如果直接返回一个dict，又没有指定模板，那就当作是rest api 把类型设置成json
-                resp = web.Response(body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
+                resp = web.Response(body=json_dumps(r))
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:   #有模板，就当作html处理
                 r['__user__'] = request.__user__    #把拦截器处理的__user__ 自动加上
-                resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
+                resp = web.Response(body=render_template(app['__templating__'], template, r).encode('utf-8'))
                 resp.content_type = 'text/html;charset=utf-8'
                 return resp
         if isinstance(r, int) and r >= 100 and r < 600:
@@ -129,10 +245,17 @@ async def response_factory(app, handler):
 
 async def init(loop):
     await orm.create_pool(loop=loop, **configs.db)
-    app = web.Application(middlewares=[
-        logger_factory, auth_factory, response_factory
-    ])
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+    set_json_backend(configs.api.json_backend)
+    middlewares = [logger_factory, auth_factory, response_factory]
+    if configs.pagecache.enabled:
+        middlewares.insert(-1, page_cache_factory)
+    if configs.db.identity_map:
+        middlewares.insert(1, identity_map_factory)     #放在auth前面 cookie2user查出的用户也在里面
+    middlewares.insert(1, compression_factory)      #除了日志最外面一层 压缩最终的body
+    app = web.Application(middlewares=middlewares)
+    render.init_executor(**configs.markdown.executor)
+    assets.init()
+    init_jinja2(app, filters=dict(datetime=datetime_filter), **configs.templates)
     add_routes(app, 'handlers')
     add_static(app)
     srv = await loop.create_server(app.make_handler(), '127.0.0.1', 9000)
@@ -140,8 +263,10 @@ async def init(loop):
     logging.info('server started at http://127.0.0.1:9000...')
     return srv
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
+if __name__ == '__main__':
+    log.setup(configs.logging)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(init(loop))
+    loop.run_forever()
 
 
@@ -0,0 +1,60 @@
+#静态文件指纹 把文件内容的hash加到文件名里 css/uikit.min.css => css/uikit.min.3f2a9c1e0b.css
+#内容变了url就变了 所以带指纹的url可以让浏览器永久缓存(Cache-Control: immutable) 不用每个页面都去确认一遍
+#模板里用{{ static_url('css/uikit.min.css') }}生成url coreweb.add_static()把带指纹的文件名映射回原来的文件
+#每次启动都按static/下现在的文件重新算(几毫秒) 不存manifest文件 免得部署时忘了重新生成 旧指纹指向新内容被浏览器缓存一年
+#css里的相对路径(比如../fonts/)不受影响 因为指纹只改文件名不改目录
+
+import hashlib, logging, os, time
+
+from config import configs
+
+STATIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+#precompress.py生成的压缩文件跟着原文件走 不单独加指纹
+_SKIP_SUFFIXES = ('.gz', '.br')
+
+_log = logging.getLogger('assets')
+
+_options = configs.assets
+_manifest = {}  #原文件名 => 带指纹的文件名 都是相对static/的路径 用/分隔
+_reverse = {}   #带指纹的文件名 => 原文件名
+
+#带指纹的url的缓存时间 一年
+MAX_AGE = 365 * 86400
+
+def fingerprint(name, data):
+    root, ext = os.path.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha1(data).hexdigest()[:10], ext)
+
+#算出static/下每个文件的指纹
+def build_manifest(path=STATIC_PATH):
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith(_SKIP_SUFFIXES):
+                continue
+            full = os.path.join(dirpath, filename)
+            name = os.path.relpath(full, path).replace(os.sep, '/')
+            with open(full, 'rb') as f:
+                manifest[name] = fingerprint(name, f.read())
+    return manifest
+
+#app启动时调用 fingerprint关掉时static_url()原样返回
+def init():
+    global _manifest, _reverse
+    if not _options.fingerprint:
+        _manifest, _reverse = {}, {}
+        return
+    start = time.perf_counter()
+    manifest = build_manifest()
+    _log.info('build asset manifest: %s files in %.1fms', len(manifest), (time.perf_counter() - start) * 1000)
+    _manifest = manifest
+    _reverse = dict((v, k) for k, v in manifest.items())
+
+#jinja2的全局函数 name是相对static/的路径
+def static_url(name):
+    return '/static/' + _manifest.get(name, name)
+
+#带指纹的文件名 => 原文件名 不是带指纹的文件名(或者指纹过期了)返回None
+def resolve(name):
+    return _reverse.get(name)
@@ -0,0 +1,38 @@
+#把数据库里blog保存的html重新渲染一遍 markdown2升级或者修改了config里markdown的extras/safe_mode之后执行
+#用法: python backfill.py          只渲染render_version不是当前版本的blog
+#      python backfill.py --all    全部重新渲染
+#第一次使用前先给blogs表加上两列:
+#   alter table blogs add column `html_content` mediumtext, add column `render_version` varchar(50);
+import asyncio, logging, sys
+
+import log, orm
+from models import Blog
+from render import render_blog, RENDER_VERSION
+from config import configs
+
+BATCH_SIZE = 100
+
+async def backfill(loop, force=False):
+    await orm.create_pool(loop=loop, **configs.db)
+    count = 0
+    last_id = ''
+    while True:
+        #按id翻页 每次从上一批的最后一个id往后取 降级渲染(render_version还是null)或者更新失败的行不会被再查出来
+        if force:   #全部重新渲染
+            blogs = await Blog.findAll('`id`>?', [last_id], orderBy='id', limit=BATCH_SIZE)
+        else:
+            blogs = await Blog.findAll('(render_version is null or render_version<>?) and `id`>?', [RENDER_VERSION, last_id], orderBy='id', limit=BATCH_SIZE)
+        if not blogs:
+            break
+        last_id = blogs[-1].id
+        for blog in blogs:
+            await render_blog(blog)
+            await blog.update()
+        count += len(blogs)
+        logging.info('已重新渲染 %s 篇blog' % count)
+    logging.info('backfill完成 渲染版本: %s 共 %s 篇' % (RENDER_VERSION, count))
+
+if __name__ == '__main__':
+    log.setup(configs.logging)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(backfill(loop, force='--all' in sys.argv[1:]))
@@ -0,0 +1,602 @@
+#性能测试 不依赖数据库和aiohttp服务 直接测核心代码的耗时
+#用法: python bench.py <名字>   不带名字就列出所有测试
+import gc, json, os, random, sys, time, tracemalloc
+
+import markdown2
+
+#把fn重复执行number次 取repeat轮里最快的一轮 返回每次调用的微秒数
+#计时时和标准库timeit一样关掉gc 减少抖动
+def timeit(fn, number=1000, repeat=5):
+    best = None
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            for j in range(number):
+                fn()
+            t = time.perf_counter() - start
+            if best is None or t < best:
+                best = t
+    finally:
+        gc.enable()
+    return best / number * 1e6
+
+SHORT_COMMENTS = [
+    u'沙发',
+    u'写得不错 *赞*',
+    u'请问 `asyncio` 和 `aiohttp` 的版本是多少?',
+    u'参考 [官方文档](https://docs.python.org/3/) 就好了',
+]
+
+#每次新建Markdown对象 vs 从转换器池里复用 短评论上差距最明显
+def bench_markdown_pool(argv):
+    extras = ['fenced-code-blocks', 'footnotes']
+    pool = markdown2.markdown_pool(extras=extras)
+    print('construct Markdown: %.1fus' % timeit(lambda: markdown2.Markdown(extras=extras), number=5000))
+    for text in SHORT_COMMENTS:
+        fresh = timeit(lambda: markdown2.Markdown(extras=extras).convert(text), number=2000, repeat=7)
+        pooled = timeit(lambda: pool.convert(text), number=2000, repeat=7)
+        print('%-40r new Markdown: %8.1fus   pool: %8.1fus   (%.2fx)' % (text[:38], fresh, pooled, fresh / pooled))
+
+#第一轮渲染之后 再渲染就不应该再编译任何正则
+def bench_regex_report(argv):
+    extras = ['fenced-code-blocks', 'footnotes', 'tables', 'wiki-tables', 'pyshell']
+    for i in range(2):
+        for text in SHORT_COMMENTS:
+            markdown2.markdown(text, extras=extras)
+        report = markdown2.regex_compile_report()
+        print('round %s: %s regexes compiled  %s' % (i + 1, sum(report.values()), report))
+        if i == 0:
+            first = report
+    if report != first:
+        print('FAIL: regexes compiled in steady state')
+        return 1
+
+#生成一篇大约size个字符的博客 段落/列表/代码/引用都有 固定随机种子 每次生成的都一样
+WORDS = ['asyncio', 'aiohttp', u'协程', u'事件循环', 'markdown', u'数据库', 'ORM', u'缓存', u'渲染', 'python']
+
+def make_post(size, seed=1):
+    rnd = random.Random(seed)
+    def sentence():
+        words = [rnd.choice(WORDS) for i in range(rnd.randint(5, 15))]
+        i = rnd.randrange(len(words))
+        words[i] = rnd.choice(['*%s*', '**%s**', '`%s`', '[%s][docs]']) % words[i]
+        return ' '.join(words) + '.'
+    blocks = []
+    n = 0
+    while n < size:
+        kind = rnd.choice(['p', 'p', 'p', 'h', 'ul', 'code', 'quote'])
+        if kind == 'h':
+            block = '## %s' % sentence()
+        elif kind == 'ul':
+            block = '\n'.join('* %s' % sentence() for i in range(rnd.randint(2, 5)))
+        elif kind == 'code':
+            block = '\n'.join('    %s = %s(%s)' % (rnd.choice(WORDS), rnd.choice(WORDS), i) for i in range(rnd.randint(2, 8)))
+        elif kind == 'quote':
+            block = '> %s' % sentence()
+        else:
+            block = ' '.join(sentence() for i in range(rnd.randint(2, 6)))
+        blocks.append(block)
+        n += len(block) + 2
+    blocks.append('[docs]: https://docs.python.org/3/ "Python"')
+    return '\n\n'.join(blocks)
+
+#200KB的文章只改一个段落 整篇重新渲染 vs 增量渲染
+def bench_incremental(argv):
+    post = make_post(200 * 1024)
+    blocks = post.split('\n\n')
+    middle = len(blocks) // 2
+    while blocks[middle][0] in '#*> ':     #找一个普通段落来改
+        middle += 1
+    edits = []
+    for i in range(20):
+        edited = list(blocks)
+        edited[middle] += u' 第%s次修改' % i
+        edits.append('\n\n'.join(edited))
+    pool = markdown2.markdown_pool()
+    inc = markdown2.IncrementalMarkdown()
+    inc.convert(post)
+    print('post: %s chars, %s blocks' % (len(post), inc.last_stats['blocks']))
+    full = incremental = 0
+    for edited in edits:    #每次都是新的改动 增量渲染只能复用没改的块
+        start = time.perf_counter()
+        expected = pool.convert(edited)
+        full += time.perf_counter() - start
+        start = time.perf_counter()
+        html = inc.convert(edited)
+        incremental += time.perf_counter() - start
+        if html != expected:
+            print('FAIL: incremental output differs from full conversion')
+            return 1
+    print('last edit: %s' % inc.last_stats)
+    print('full convert: %8.1fms   incremental: %8.1fms   (%.1fx)' % (full / len(edits) * 1000, incremental / len(edits) * 1000, full / incremental))
+
+#markdown2的基准测试语料 bench_corpus/下是真实的评论和文章 再加上生成的超大文章和病态输入
+#python bench.py corpus            和bench_baseline.json比较 吞吐量下降超过阈值就失败
+#python bench.py corpus --save     把这次的结果保存成新的基准
+#python bench.py corpus --threshold=0.3
+#基准是绝对耗时 换了机器要先--save重新记录
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BASE_DIR, 'bench_corpus')
+BASELINE_FILE = os.path.join(BASE_DIR, 'bench_baseline.json')
+CORPUS_EXTRAS = ['fenced-code-blocks', 'footnotes', 'tables']
+
+#病态输入 每一个都是以前会让正则回溯到超时的写法 生成函数的参数n是重复次数
+PATHOLOGICAL_GENERATORS = {
+    'emphasis': lambda n: '*a **b _c ' * n,
+    'open-links': lambda n: '[a](' * n,
+    'open-images': lambda n: '![a](' * n,
+    'open-brackets': lambda n: '[' * n + 'a',
+    'code-spans': lambda n: ''.join('`' * (i % 50 + 1) + 'a ' for i in range(n)),
+    'autolinks': lambda n: '<http://' * n,
+    'html-blocks': lambda n: '<div>\n' * n,
+    'nested-quotes': lambda n: '>' * n + ' deep',
+    'nested-lists': lambda n: ''.join('%s* item\n' % ('    ' * (i % 40)) for i in range(n)),
+    'table-row': lambda n: '|a' * n + '\n' + '|-' * n + '\n',
+}
+
+PATHOLOGICAL = dict((name, gen(1000)) for name, gen in PATHOLOGICAL_GENERATORS.items())
+
+def read_corpus_file(name):
+    with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+#返回[(名字, [文本...])] 评论是一组短文本 一起计时
+def load_corpus():
+    code = read_corpus_file('post-code.md')
+    docs = [
+        ('comments', read_corpus_file('comments.md').split('\n---8<---\n')),
+        ('post-medium', [read_corpus_file('post-medium.md')]),
+        ('post-code', [code]),
+        ('post-huge-code', ['\n\n'.join([code] * 50)]),
+    ]
+    for name in sorted(PATHOLOGICAL):
+        docs.append(('pathological-' + name, [PATHOLOGICAL[name]]))
+    return docs
+
+#分阶段计时 这几个方法会互相嵌套和递归调用 每个阶段只统计最外层那次调用的耗时
+PHASES = ['_detab', '_hash_html_blocks', '_run_block_gamut', '_run_span_gamut', '_do_links']
+
+class PhaseMarkdown(markdown2.Markdown):
+
+    def __init__(self, **kw):
+        markdown2.Markdown.__init__(self, **kw)
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self._phase_depth = dict.fromkeys(PHASES, 0)
+
+def _timed_phase(name):
+    method = getattr(markdown2.Markdown, name)
+    def wrapper(self, *args, **kw):
+        self._phase_depth[name] += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kw)
+        finally:
+            self._phase_depth[name] -= 1
+            if self._phase_depth[name] == 0:
+                self.phase_times[name] += time.perf_counter() - start
+    return wrapper
+
+for name in PHASES:
+    setattr(PhaseMarkdown, name, _timed_phase(name))
+
+def phase_times(texts):
+    m = PhaseMarkdown(extras=CORPUS_EXTRAS)
+    for text in texts:
+        m.convert(text)
+    return m.phase_times
+
+#转换过程中的内存峰值(字节)
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_corpus(argv):
+    threshold = 0.25
+    for arg in argv:
+        if arg.startswith('--threshold='):
+            threshold = float(arg[len('--threshold='):])
+    pool = markdown2.markdown_pool(extras=CORPUS_EXTRAS)
+    results = {}
+    print('%-28s %8s %10s %9s %8s   %s' % ('name', 'bytes', 'us/conv', 'KB/s', 'peakKB', '  '.join('%s(ms)' % p.strip('_') for p in PHASES)))
+    for name, texts in load_corpus():
+        size = sum(len(t.encode('utf-8')) for t in texts)
+        convert = lambda: [pool.convert(t) for t in texts]
+        start = time.perf_counter()
+        convert()
+        once = time.perf_counter() - start
+        us = timeit(convert, number=max(1, int(0.1 / max(once, 1e-6))), repeat=7)
+        phases = phase_times(texts)
+        peak = peak_memory(convert)
+        results[name] = us
+        print('%-28s %8d %10.1f %9.1f %8.1f   %s' % (name, size, us, size / us * 1e6 / 1024, peak / 1024.0, '  '.join('%*.2f' % (len(p) + 2, phases[p] * 1000) for p in PHASES)))
+    if '--save' in argv:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(dict(extras=CORPUS_EXTRAS, results=results), f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % BASELINE_FILE)
+        return
+    if not os.path.exists(BASELINE_FILE):
+        print('no baseline yet, run with --save first')
+        return
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)['results']
+    #吞吐量下降超过threshold 也就是耗时超过基准的1/(1-threshold)倍
+    failed = False
+    for name, us in sorted(results.items()):
+        base = baseline.get(name)
+        if base and us > base / (1 - threshold):
+            print('FAIL: %s %.1fus vs baseline %.1fus (-%.0f%% throughput)' % (name, us, base, (1 - base / us) * 100))
+            failed = True
+    if failed:
+        return 1
+    print('OK: no regression beyond %.0f%%' % (threshold * 100))
+
+#病态输入的规模每翻一倍 耗时也应该大约翻一倍 平均超过max_ratio倍说明又出现了超线性的回溯
+#按几次翻倍的几何平均算 单次计时的抖动不会误报
+#python bench.py linear
+#python bench.py linear --max-ratio=4
+def bench_linear(argv):
+    max_ratio = 3.0
+    for arg in argv:
+        if arg.startswith('--max-ratio='):
+            max_ratio = float(arg[len('--max-ratio='):])
+    pool = markdown2.markdown_pool(extras=CORPUS_EXTRAS)
+    sizes = [1000, 2000, 4000, 8000]
+    failed = False
+    for name in sorted(PATHOLOGICAL_GENERATORS):
+        gen = PATHOLOGICAL_GENERATORS[name]
+        times = []
+        for n in sizes:
+            text = gen(n)
+            times.append(timeit(lambda: pool.convert(text), number=1, repeat=5))
+        ratios = [b / max(a, 1.0) for a, b in zip(times, times[1:])]
+        mean = (times[-1] / max(times[0], 1.0)) ** (1.0 / len(ratios))
+        status = 'ok'
+        if mean > max_ratio:
+            status = 'FAIL'
+            failed = True
+        print('%-16s %s   ratios: %s  mean %.2f   %s' % (name, '  '.join('%9.1fms' % (t / 1000) for t in times), ' '.join('%.2f' % r for r in ratios), mean, status))
+    if failed:
+        print('FAIL: superlinear conversion time (2x input > %.1fx time)' % max_ratio)
+        return 1
+    print('OK: all pathological inputs scale linearly')
+
+#按块输出(convert_iter)和增量渲染(IncrementalMarkdown)拼起来必须和convert()一模一样
+#EDGE_CASES是以前切块切错的写法: 只有标记没有内容的列表项会把空行后面的段落吞进列表
+#python bench.py iter-equivalence
+EDGE_CASES = [
+    '1. \n\nplain para\n',
+    '1.  \n\nplain\n',
+    '- \n\nplain\n\nmore\n',
+    'x\n\n* \n\ny\n',
+    '* a\n* \n\nb\n',
+    '1.\t\n\npara\n\n2. item\n',
+]
+
+def bench_iter_equivalence(argv):
+    texts = [('edge-%s' % i, text) for i, text in enumerate(EDGE_CASES)]
+    for name, docs in load_corpus():
+        texts.extend(('%s-%s' % (name, i), text) for i, text in enumerate(docs) if len(text) < 100000)
+    texts.append(('generated-post', make_post(50 * 1024)))
+    failed = 0
+    for extras in ([], CORPUS_EXTRAS):
+        for safe_mode in (None, 'escape'):
+            inc = markdown2.IncrementalMarkdown(extras=extras, safe_mode=safe_mode)
+            for name, text in texts:
+                expected = markdown2.Markdown(extras=extras, safe_mode=safe_mode).convert(text)
+                streamed = ''.join(markdown2.Markdown(extras=extras, safe_mode=safe_mode).convert_iter(text))
+                for kind, html in (('convert_iter', streamed), ('incremental', str(inc.convert(text)))):
+                    if html != expected:
+                        failed += 1
+                        print('FAIL: %s differs from convert() on %s (extras=%s safe_mode=%s)' % (kind, name, extras, safe_mode))
+    if failed:
+        return 1
+    print('OK: %s texts x 4 option sets' % len(texts))
+
+#静态文件的吞吐量: 中间件按路由的认证策略跳过cookie解析和日志 vs 每个请求都走一遍(以前的行为)
+#需要aiohttp 不连数据库 请求带的cookie事先放进会话缓存 cookie2user不会去查库
+def bench_static(argv):
+    try:
+        import asyncio, logging
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer, TestClient
+    except ImportError:
+        print('aiohttp not installed, skipped')
+        return
+    logging.getLogger().handlers = [logging.StreamHandler(open(os.devnull, 'w'))]   #日志照常格式化 只是不打到终端
+    logging.getLogger().setLevel(logging.INFO)
+    import app, coreweb, handlers, session
+    from models import User
+    user = User(id='bench', name='bench', email='bench@example.com', passwd='x' * 40, admin=False, image='')
+    cookie = handlers.user2cookie(user, 86400)
+    session.put(cookie, user.id, user, time.time() + 86400)
+    n = 2000
+    async def run():
+        application = web.Application(middlewares=[app.logger_factory, app.auth_factory, app.response_factory])
+        coreweb.add_static(application)
+        client = TestClient(TestServer(application))
+        await client.start_server()
+        try:
+            for i in range(100):    #预热
+                await (await client.get('/static/css/awesome.css', cookies={handlers.COOKIE_NAME: cookie})).read()
+            start = time.perf_counter()
+            for i in range(n):
+                resp = await client.get('/static/css/awesome.css', cookies={handlers.COOKIE_NAME: cookie})
+                await resp.read()
+            return (time.perf_counter() - start) / n * 1e6
+        finally:
+            await client.close()
+    loop = asyncio.new_event_loop()
+    route_auth = app.route_auth
+    try:
+        app.route_auth = lambda request: 'optional'     #以前的行为: 所有请求都解析cookie 记日志
+        legacy = loop.run_until_complete(run())
+        app.route_auth = route_auth
+        bypass = loop.run_until_complete(run())
+    finally:
+        app.route_auth = route_auth
+        loop.close()
+    print('static GET: every request authenticated %8.1fus   auth=none bypass %8.1fus   (%.2fx)' % (legacy, bypass, legacy / bypass))
+
+#coreweb.RequestHandler每个请求绑定参数的开销 不经过网络和中间件 直接调用handler
+#处理函数里没有真正的await 所以不需要事件循环 用send(None)把协程跑完
+def run_coroutine(coro):
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('coroutine suspended')
+
+def bench_dispatch(argv):
+    try:
+        import logging
+        from aiohttp.test_utils import make_mocked_request
+    except ImportError:
+        print('aiohttp not installed, skipped')
+        return
+    logging.getLogger().handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+    import coreweb
+    async def no_args():
+        return 'ok'
+    async def path_arg(id):
+        return id
+    async def query_kw(*, page='1', cursor=None):
+        return page
+    async def request_and_kw(id, request, *, page='1'):
+        return id
+    async def var_kw(**kw):
+        return kw
+    cases = [
+        ('no args', no_args, '/', {}),
+        ('path arg', path_arg, '/blog/123', {'id': '123'}),
+        ('query kw', query_kw, '/api/blogs?page=2&x=1&y=2', {}),
+        ('request + kw', request_and_kw, '/blog/123?page=3', {'id': '123'}),
+        ('**kw', var_kw, '/api/x?a=1&b=2&c=3', {}),
+    ]
+    for name, fn, path, match_info in cases:
+        handler = coreweb.RequestHandler(None, fn)
+        request = make_mocked_request('GET', path, match_info=match_info)
+        us = timeit(lambda: run_coroutine(handler(request)), number=20000, repeat=7)
+        print('%-14s %6.2fus/request' % (name, us))
+
+#一个请求在中间件/RequestHandler/orm里要记的日志 调用方(事件循环线程)花的时间
+#以前: 根logger INFO 同步写 每条都先用%格式化  现在: 分子系统的logger 参数延迟格式化 放进队列由后台线程写
+def bench_logging(argv):
+    import logging, logging.handlers, queue
+    import log
+    #默认写到临时文件 每条日志flush一次 和写日志文件/终端一样; --devnull只算格式化的开销
+    import tempfile
+    sink = open(os.devnull, 'w') if '--devnull' in argv else tempfile.TemporaryFile('w')
+    fmt = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s: %(message)s')
+    method, path, email, rows = 'GET', '/api/blogs', 'bench@example.com', 5
+    sql = 'select `id`, `user_id`, `user_name`, `name`, `summary`, `created_at` from `blogs` order by created_at desc limit ?'
+    kw = dict(page='2', cursor=None)
+    def legacy():
+        logging.info('Request: %s %s' % (method, path))
+        logging.info('check user: %s %s' % (method, path))
+        logging.info('set current user: %s' % email)
+        logging.info('Response handler... ')
+        logging.info('call with args: %s' % str(kw))
+        logging.info('查询sql: %s' % sql)
+        logging.info('返回行数：%s' % rows)
+    access, auth, coreweb, orm_sql = [logging.getLogger(name) for name in ('access', 'auth', 'coreweb', 'orm.sql')]
+    def current():
+        access.info('Request: %s %s', method, path)
+        auth.debug('check user: %s %s', method, path)
+        auth.info('set current user: %s', email)
+        coreweb.debug('call with args: %s', kw)
+        orm_sql.info('查询sql: %s', sql)
+        orm_sql.info('返回行数：%s', rows)
+    root = logging.getLogger()
+    output = logging.StreamHandler(sink)
+    output.setFormatter(fmt)
+    root.setLevel(logging.INFO)
+    root.handlers = [output]
+    print('legacy   (root INFO, sync)            %6.2fus/request' % timeit(legacy, number=5000))
+    print('lazy     (subsystems INFO, sync)      %6.2fus/request' % timeit(current, number=5000))
+    handler = log.AsyncQueueHandler(queue.Queue(100000))
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    root.handlers = [handler]
+    try:
+        print('queued   (subsystems INFO, queue)     %6.2fus/request' % timeit(current, number=5000))
+        orm_sql.setLevel(logging.WARNING)
+        sampler = log.SampleFilter(0.1)
+        access.addFilter(sampler)
+        print('prod     (orm.sql off, access 10%%)    %6.2fus/request' % timeit(current, number=5000))
+    finally:
+        listener.stop()
+        access.removeFilter(sampler)
+        orm_sql.setLevel(logging.NOTSET)
+    print('dropped: %s' % handler.dropped)
+
+#jinja2模板: 冷启动编译所有模板(有没有bytecode cache) 每个请求get_template+render(auto_reload开/关)
+def bench_templates(argv):
+    try:
+        import logging, shutil, tempfile
+        from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+    except ImportError:
+        print('jinja2 not installed, skipped')
+        return
+    logging.getLogger().handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+    import app
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    cache_dir = tempfile.mkdtemp()
+    def env(**kw):
+        e = Environment(loader=FileSystemLoader(path), autoescape=True, **kw)
+        e.filters['datetime'] = app.datetime_filter
+        return e
+    try:
+        app.preload_templates(env(bytecode_cache=FileSystemBytecodeCache(cache_dir)))    #先写一遍bytecode cache
+        cold = timeit(lambda: app.preload_templates(env()), number=5, repeat=3)
+        warm = timeit(lambda: app.preload_templates(env(bytecode_cache=FileSystemBytecodeCache(cache_dir))), number=5, repeat=3)
+    finally:
+        shutil.rmtree(cache_dir)
+    print('preload all templates: compile %8.1fms   bytecode cache %8.1fms   (%.2fx)' % (cold / 1000, warm / 1000, cold / warm))
+    now = time.time()
+    blogs = [dict(id='%032d' % i, name='Blog %s' % i, summary='summary ' * 20, created_at=now - i * 3600) for i in range(5)]
+    page = dict(has_previous=True, has_next=True, page_index=2)
+    kw = dict(blogs=blogs, page=page, __user__=None)
+    for auto_reload in (True, False):
+        e = env(auto_reload=auto_reload)
+        us = timeit(lambda: app.render_template(e, 'blogs.html', kw), number=2000)
+        print('render blogs.html auto_reload=%-5s %8.1fus/request' % (auto_reload, us))
+    print('template stats: %s' % app.template_stats())
+
+#整页缓存: 匿名用户访问首页 每次渲染模板 vs 命中缓存 vs 带If-None-Match的304
+#处理函数不查数据库 直接返回5篇博客 和首页一样用blogs.html渲染
+def bench_pagecache(argv):
+    try:
+        import asyncio, logging
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer, TestClient
+    except ImportError:
+        print('aiohttp not installed, skipped')
+        return
+    logging.getLogger().handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+    import app, coreweb, pagecache
+    now = time.time()
+    blogs = [dict(id='%032d' % i, name='Blog %s' % i, summary='summary ' * 20, created_at=now - i * 3600) for i in range(5)]
+    @coreweb.get('/', cache=True)
+    async def index(*, page='1'):
+        return {'__template__': 'blogs.html', 'page': dict(has_previous=True, has_next=True, page_index=int(page)), 'blogs': blogs}
+    n = 1000
+    async def run(middlewares, headers=None):
+        application = web.Application(middlewares=middlewares)
+        app.init_jinja2(application, filters=dict(datetime=app.datetime_filter), auto_reload=False)
+        #aiohttp 3.x要求不是协程函数的处理函数直接返回StreamResponse 所以包一层协程再注册
+        handler = coreweb.RequestHandler(application, index)
+        async def route(request):
+            return (await handler(request))
+        route.__auth__, route.__cache__, route.__query_params__ = handler.__auth__, handler.__cache__, handler.__query_params__
+        application.router.add_route('GET', '/', route)
+        client = TestClient(TestServer(application))
+        await client.start_server()
+        try:
+            for i in range(100):    #预热 第一次请求把页面放进缓存
+                await (await client.get('/?page=2', headers=headers)).read()
+            start = time.perf_counter()
+            for i in range(n):
+                resp = await client.get('/?page=2', headers=headers)
+                await resp.read()
+            return (time.perf_counter() - start) / n * 1e6, resp.status
+        finally:
+            await client.close()
+    loop = asyncio.new_event_loop()
+    try:
+        uncached, status = loop.run_until_complete(run([app.logger_factory, app.auth_factory, app.response_factory]))
+        cached, status = loop.run_until_complete(run([app.logger_factory, app.auth_factory, app.page_cache_factory, app.response_factory]))
+        entry = pagecache.get('/', (('page', '2'),))
+        revalidated, status = loop.run_until_complete(run([app.logger_factory, app.auth_factory, app.page_cache_factory, app.response_factory], {'If-None-Match': entry[1]}))
+    finally:
+        loop.close()
+    print('anonymous GET /?page=2: render %8.1fus   cached %8.1fus (%.2fx)   304 %8.1fus (%.2fx, status %s)' % (uncached, cached, uncached / cached, revalidated, uncached / revalidated, status))
+    print('page cache stats: %s' % pagecache.stats())
+
+#api返回的json 和/api/blogs一样是{page: Page, blogs: [Blog]} Blog是summary视图的字段
+#以前: json.dumps(default=lambda o: o.__dict__)再encode  现在: apis.json_dumps 标准库/orjson两个后端
+def bench_json(argv):
+    import json
+    import apis
+    from models import Blog
+    now = time.time()
+    def payload(n):
+        blogs = [Blog(id='%050d' % i, user_id='%050d' % 1, user_name='博主', user_image='http://www.gravatar.com/avatar/%032d?d=mm&s=120' % i,
+                      name='第%s篇博客' % i, summary='这是一篇博客的摘要 summary ' * 8, created_at=now - i * 3600) for i in range(n)]
+        p = apis.Page(1000, 2, n)
+        p.set_cursors((blogs[0].created_at, blogs[0].id), (blogs[-1].created_at, blogs[-1].id))
+        return dict(page=p, blogs=blogs)
+    backends = ['json'] + (['orjson'] if apis.orjson is not None else [])
+    for n in (5, 50):
+        r = payload(n)
+        legacy = timeit(lambda: json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'), number=2000)
+        line = '/api/blogs %2s blogs: legacy %7.1fus' % (n, legacy)
+        for backend in backends:
+            apis.set_json_backend(backend)
+            us = timeit(lambda: apis.json_dumps(r), number=2000)
+            line += '   %s %7.1fus (%.2fx)' % (backend, us, legacy / us)
+        print(line)
+    apis.set_json_backend()
+
+#响应压缩: 静态文件预压缩后省下的字节数 动态响应(首页html / 50篇博客的json)压缩的耗时和大小
+def bench_compress(argv):
+    import asyncio, logging
+    logging.getLogger().handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+    import compress
+    static = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for name in ('css/uikit.min.css', 'js/jquery.min.js', 'js/vue.min.js', 'fonts/fontawesome-webfont.ttf'):
+        filename = os.path.join(static, name)
+        line = '%-32s %8d bytes' % (name, os.path.getsize(filename))
+        for encoding in compress.ENCODINGS:
+            target = filename + compress.PRECOMPRESSED_SUFFIX[encoding]
+            if os.path.isfile(target):
+                line += '   %s %8d' % (encoding, os.path.getsize(target))
+            else:
+                line += '   %s (run precompress.py)' % encoding
+        print(line)
+    now = time.time()
+    html = ''.join('<article class="uk-article"><h2><a href="/blog/%032d">第%s篇博客</a></h2><p class="uk-article-meta">发表于%s</p><p>%s</p></article>' % (i, i, now, '这是一篇博客的摘要 summary ' * 8) for i in range(5)).encode('utf-8') * 4
+    import apis
+    from models import Blog
+    blogs = [Blog(id='%050d' % i, user_id='%050d' % 1, user_name='博主', name='第%s篇博客' % i, summary='这是一篇博客的摘要 summary ' * 8, created_at=now - i * 3600) for i in range(50)]
+    body = apis.json_dumps(dict(page=apis.Page(1000, 2, 50), blogs=blogs))
+    for name, data in (('html page', html), ('json 50 blogs', body)):
+        for encoding in compress.ENCODINGS:
+            us = timeit(lambda: compress.compress(data, encoding), number=200)
+            print('%-14s %7d bytes => %s %7d bytes  %7.1fus' % (name, len(data), encoding, len(compress.compress(data, encoding)), us))
+    loop = asyncio.new_event_loop()
+    try:
+        us = timeit(lambda: loop.run_until_complete(compress.compress_body(html, 'gzip', '"bench"')), number=200)
+    finally:
+        loop.close()
+    print('html page cached by ETag      %7.1fus' % us)
+
+BENCHES = {
+    'compress': bench_compress,
+    'corpus': bench_corpus,
+    'dispatch': bench_dispatch,
+    'incremental': bench_incremental,
+    'iter-equivalence': bench_iter_equivalence,
+    'json': bench_json,
+    'linear': bench_linear,
+    'logging': bench_logging,
+    'markdown-pool': bench_markdown_pool,
+    'pagecache': bench_pagecache,
+    'regex-report': bench_regex_report,
+    'static': bench_static,
+    'templates': bench_templates,
+}
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in BENCHES:
+        print('usage: python bench.py <%s>' % '|'.join(sorted(BENCHES)))
+        return 1
+    return BENCHES[argv[1]](argv[2:])
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
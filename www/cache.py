@@ -0,0 +1,64 @@
+import collections, sys, threading
+
+#带容量上限的LRU缓存 同时限制条目数和占用字节数 超出时从最久未使用的一端淘汰
+#sizeof用来估算每个value占用的内存 默认用sys.getsizeof
+class LRUCache(object):
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=sys.getsizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = collections.OrderedDict()  #key => (value, size) 越靠后越新
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)     #命中就挪到最新的位置
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:   #单个值比整个缓存还大 不缓存
+                return False
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                k, (v, s) = self._data.popitem(last=False)  #淘汰最久未使用的
+                self.bytes -= s
+                self.evictions += 1
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self.bytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return dict(entries=len(self._data), bytes=self.bytes, hits=self.hits, misses=self.misses, evictions=self.evictions)
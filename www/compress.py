@@ -0,0 +1,80 @@
+import asyncio, gzip
+
+from cache import LRUCache
+from config import configs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#响应压缩 按Accept-Encoding选br(装了brotli时)或gzip
+#动态响应由app.py里的中间件压缩 大的body放到线程池里压缩 不阻塞事件循环
+#静态文件由precompress.py预先压缩成.gz/.br 见coreweb.add_static()
+
+_options = configs.compress
+_min_size = _options.min_size
+_executor_size = _options.executor_size
+_gzip_level = _options.gzip_level
+_brotli_quality = _options.brotli_quality
+_types = tuple(_options.types)
+
+#带ETag的响应(整页缓存)内容不变 压缩结果按(etag, encoding)缓存起来
+_cache = LRUCache(max_entries=_options.cache.max_entries, max_bytes=_options.cache.max_bytes, sizeof=len)
+
+#服务端支持的编码 按优先级排列
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+#precompress.py生成的压缩文件的后缀
+PRECOMPRESSED_SUFFIX = {'br': '.br', 'gzip': '.gz'}
+
+#解析Accept-Encoding 返回available里客户端接受的第一个编码 没有就返回None
+#q=0表示明确不要 *表示其他编码都可以
+def negotiate(accept_encoding, available=ENCODINGS):
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    for coding in available:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+#太小的body压缩了也省不了多少 图片/字体这些本来就是压缩过的
+def compressible(content_type, size):
+    return size >= _min_size and bool(content_type) and content_type.lower().startswith(_types)
+
+def compress(body, encoding, gzip_level=None, brotli_quality=None):
+    if encoding == 'br':
+        return brotli.compress(body, quality=_brotli_quality if brotli_quality is None else brotli_quality)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=_gzip_level if gzip_level is None else gzip_level, mtime=0)
+    raise ValueError('Unsupported encoding: %s' % encoding)
+
+#压缩动态响应的body 超过executor_size的放到默认线程池里 zlib和brotli压缩时会释放GIL
+async def compress_body(body, encoding, etag=None):
+    key = (etag, encoding) if etag else None
+    if key is not None:
+        data = _cache.get(key)
+        if data is not None:
+            return data
+    if len(body) < _executor_size:
+        data = compress(body, encoding)
+    else:
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, compress, body, encoding)
+    if key is not None:
+        _cache.put(key, data)
+    return data
+
+def cache_stats():
+    return _cache.stats()
@@ -6,9 +6,84 @@ configs = {
         'port': 3306,
         'user': 'root',
         'password': 'admin',
-        'database': 'awesome'
+        'database': 'awesome',
+        'count_ttl': 60,    #分页总数的缓存秒数 过期后重新count一次
+        'batch_size': 500,  #saveAll/updateAll/removeAll一条语句最多写多少行
+        'identity_map': True    #每个请求一个identity map 重复find同一行只查一次
     },
     'session': {
-        'secret': 'Awesome'
+        'secret': 'Awesome',
+        'cache_ttl': 300,       #验证过的会话缓存秒数 远小于cookie的有效期 0表示不缓存
+        'cache_size': 10000     #最多缓存多少个会话
+    },
+    'logging': {
+        'level': 'INFO',    #根日志级别 下面没单独设置的子系统都用这个
+        'format': '%(asctime)s - %(name)s - %(levelname)s: %(message)s',
+        'json': False,      #True时一行输出一个json 方便日志系统检索
+        'queue_size': 10000,    #日志队列长度 由后台线程写出 满了就丢弃 0表示同步写
+        'levels': {         #每个子系统单独的级别 比如生产环境把orm.sql设成WARNING
+            'access': 'INFO',
+            'api': 'INFO',
+            'assets': 'INFO',
+            'auth': 'INFO',
+            'coreweb': 'INFO',
+            'orm': 'INFO',
+            'orm.sql': 'INFO',
+            'render': 'INFO',
+            'templates': 'INFO'
+        },
+        'sample': {         #INFO及以下日志的采样率 1表示全部记录 WARNING以上不采样
+            'access': 1,
+            'orm.sql': 1
+        }
+    },
+    'api': {
+        'json_backend': 'auto'  #api返回的json用什么序列化 auto有orjson就用orjson json是标准库
+    },
+    'compress': {
+        'min_size': 1024,       #小于这么多字节的响应不压缩
+        'executor_size': 64 * 1024, #大于这么多字节的响应放到线程池里压缩
+        'gzip_level': 6,
+        'brotli_quality': 5,    #装了brotli才会用 动态响应用中等质量 precompress.py用最高质量
+        'types': ['text/', 'application/json', 'application/javascript', 'image/svg+xml'],
+        'cache': {              #带ETag的响应(整页缓存)的压缩结果
+            'max_entries': 1000,
+            'max_bytes': 16 * 1024 * 1024
+        }
+    },
+    'pagecache': {
+        'enabled': True,    #匿名用户访问@get(cache=True)的页面时整页缓存
+        'ttl': 60,          #缓存秒数 别的worker进程改了数据 最多这么久之后能看到
+        'max_entries': 1000,    #最多缓存多少个路径
+        'max_variants': 16,     #每个路径最多缓存多少种查询参数 超出时去掉最早放进去的
+        'max_bytes': 64 * 1024 * 1024
+    },
+    'assets': {
+        'fingerprint': False    #静态文件url带上内容hash 浏览器可以永久缓存 开发时关掉 改了css/js刷新就能看到
+    },
+    'templates': {
+        'auto_reload': True,    #模板改了马上生效 每次渲染都要检查文件 生产环境关掉
+        'preload': False,       #启动时编译所有模板
+        'bytecode_cache': None, #编译结果存到磁盘的目录 True用系统临时目录 None不存
+        'slow_ms': 50           #渲染超过这么多毫秒记一条warning
+    },
+    'markdown': {
+        'extras': [],       #markdown2的扩展语法 比如fenced-code-blocks
+        'safe_mode': None,
+        'time_budget': 2,   #单篇渲染最多用多少秒 超出降级成纯文本 None不限制
+        'cache': {
+            'max_entries': 256,     #最多缓存多少篇渲染结果
+            'max_bytes': 32 * 1024 * 1024   #渲染结果最多占用的内存
+        },
+        'executor': {
+            'kind': 'process',      #process或thread 渲染放到进程池/线程池里执行
+            'workers': 2,
+            'inline_threshold': 4096,   #小于这个字符数的内容直接在事件循环里渲染
+            'max_pending': 16,      #最多排队的渲染任务数 超出就降级成纯文本
+            'timeout': 5            #渲染超时秒数 超时降级成纯文本
+        },
+        'incremental': {
+            'max_blocks': 4096      #编辑博客时增量渲染最多缓存多少个块的html
+        }
     }
 }
\ No newline at end of file
@@ -2,5 +2,13 @@
 configs = {
     'db': {
         'host': '127.0.0.1'
+    },
+    'assets': {
+        'fingerprint': True
+    },
+    'templates': {
+        'auto_reload': False,
+        'preload': True,
+        'bytecode_cache': True
     }
 }
\ No newline at end of file
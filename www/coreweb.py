@@ -1,39 +1,73 @@
 import functools, asyncio, logging
-import inspect, os
+import inspect, mimetypes, os
 from aiohttp import web
 from urllib import parse
 from apis import APIError
+import assets, compress
+
+_log = logging.getLogger('coreweb')
+
+#路由的认证策略 由中间件按策略决定要做哪些事
+#   none        不解析cookie 也不记录请求日志 用于静态文件和不需要知道当前用户的公开接口
+#   optional    解析cookie 有登录用户就绑定到request.__user__ 默认是这个
+#   required    必须登录 没登录的页面跳转到登录页 api返回权限错误
+AUTH_POLICIES = ('none', 'optional', 'required')
+
+def check_auth_policy(auth):
+    if auth not in AUTH_POLICIES:
+        raise ValueError('Invalid auth policy: %s' % auth)
 
 #带参数的装饰器 把url和请求方式封装到函数中去
-def get(path):
+#cache=True的页面 匿名用户访问时整页缓存 见pagecache.py
+def get(path, auth='optional', cache=False):
+    check_auth_policy(auth)
     def decorator(func):
         @functools.wraps(func)
         def wapper(*args, **kw):
             return func(*args, **kw)
         wapper.__method__ = 'GET'
         wapper.__route__ = path
+        wapper.__auth__ = auth
+        wapper.__cache__ = cache
         return wapper
     return decorator
 
-def post(path):
+def post(path, auth='optional'):
+    check_auth_policy(auth)
     def decorator(func):
         @functools.wraps(func)
         def wapper(*args, **kw):
             return func(*args, **kw)
         wapper.__method__ = 'POST'
         wapper.__route__ = path
+        wapper.__auth__ = auth
         return wapper
     return decorator
 
+#当前请求匹配到的路由的认证策略 不是@get/@post注册的路由(静态文件 404等)都是'none'
+def route_auth(request):
+    return getattr(request.match_info.handler, '__auth__', 'none')
+
+#当前请求匹配到的路由能不能整页缓存
+def route_cache(request):
+    return getattr(request.match_info.handler, '__cache__', False)
+
+#整页缓存按查询参数区分页面 只留处理函数声明了的参数并排好序 ?page=2&utm_source=x和?page=2是同一页
+#处理函数有**kw(或者不知道它要哪些参数)时 所有参数都可能影响页面 只能全部保留
+def route_cache_query(request):
+    qs = request.query_string
+    if not qs:
+        return ()
+    names = getattr(request.match_info.handler, '__query_params__', None)
+    return tuple(sorted(parse_query(qs, names).items()))
+
 #给服务器添加路由,也就是url映射到处理函数 注意到 封装的路由不用提供url 因为fn被装饰了 自带url。然后再写一个add_routes()添加所有被装饰的fn。路由设置就只需要一句代码了。
 def add_route(app, fn):
     method = getattr(fn, '__method__', None)
     path = getattr(fn, '__route__', None)
     if method is None or path is None:      #确保处理函数被@get或@post装饰，以便获取url
         raise ValueError('@get or @post not defined in %s' % str(fn))
-    if not asyncio.iscoroutine(fn) and not inspect.isgeneratorfunction(fn): #把处理函数变为协程
-        fn = asyncio.coroutine(fn)
-    logging.info('add route %s %s ==> %s(%s)' % (method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys())))
+    _log.info('add route %s %s ==> %s(%s)', method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys()))
     app.router.add_route(method, path, RequestHandler(app, fn))  #调用aiohttp的路由
 
 
@@ -62,122 +96,179 @@ def add_routes(app, module_name):
 #KEYWORD_ONLY             仅命名关键字参数   （官方就叫做关键字参数）
 #VAR_KEYWORD               关键字参数 **kw   (官方叫做可变关键字参数)
 
-#获取没有默认值的关键字参数
-def get_required_kw_args(fn):
-    args = []
-    params = inspect.signature(fn).parameters
-    for name, param in params.items():
-        if param.kind == inspect.Parameter.KEYWORD_ONLY and param.default == inspect.Parameter.empty:
-            args.append(name)
-    return tuple(args)
-
-#获取所有关键字参数
-def get_named_kw_args(fn):
-    args = []
-    params = inspect.signature(fn).parameters
-    for name, param in params.items():
-        if param.kind == inspect.Parameter.KEYWORD_ONLY:
-            args.append(name)
-    return tuple(args)
-
-#是否有关键字参数
-def has_named_kw_args(fn):
-    params = inspect.signature(fn).parameters
-    for name, param in params.items():
-        if param.kind == inspect.Parameter.KEYWORD_ONLY:
-            return True
-    return False
-
-#是否有可变关键字参数
-def has_var_kw_arg(fn):
-    params = inspect.signature(fn).parameters
-    for name, param in params.items():
-        if param.kind == inspect.Parameter.VAR_KEYWORD:
-            return True
-    return False
-
-#查找是否有参数 fn是否有request参数 因为这是aiohttp框架的要求
-def has_request_arg(fn):
-    sig = inspect.signature(fn)
-    params = sig.parameters
-    found = False
-    for name, param in params.items():
-        if name == 'request':
-            found = True
+#处理函数的参数信息 注册路由时用inspect分析一次 之后每个请求都不用再分析
+class HandlerArgs(object):
+
+    def __init__(self, fn):
+        sig = inspect.signature(fn)
+        self.has_request_arg = False    #有没有request参数 有的话必须是最后一个命名参数
+        self.has_var_kw_arg = False     #有没有**kw
+        named_kw_args = []              #所有关键字参数
+        required_kw_args = []           #没有默认值的关键字参数
+        for name, param in sig.parameters.items():
+            if name == 'request':
+                self.has_request_arg = True
+                continue
+            if self.has_request_arg and (param.kind != inspect.Parameter.VAR_POSITIONAL and param.kind != inspect.Parameter.KEYWORD_ONLY and param.kind != inspect.Parameter.VAR_KEYWORD):
+                raise ValueError('request parameter must be the last named parameter in function: %s%s' % (fn.__name__, str(sig)))
+            if param.kind == inspect.Parameter.KEYWORD_ONLY:
+                named_kw_args.append(name)
+                if param.default == inspect.Parameter.empty:
+                    required_kw_args.append(name)
+            elif param.kind == inspect.Parameter.VAR_KEYWORD:
+                self.has_var_kw_arg = True
+        self.named_kw_args = tuple(named_kw_args)
+        self.required_kw_args = tuple(required_kw_args)
+        #有关键字参数或**kw 才需要解析请求体和查询字符串
+        self.reads_params = self.has_var_kw_arg or bool(self.named_kw_args)
+
+#解析POST的请求体 返回参数dict 不合法就返回400的响应
+async def read_post_params(request):
+    if not request.content_type:                #请求没有设置content_type
+        return web.HTTPBadRequest('Missing Content-Type.')
+    ct = request.content_type.lower()
+    if ct.startswith('application/json'):       #提交的内容是json格式
+        params = await request.json()
+        if not isinstance(params, dict):
+            return web.HTTPBadRequest('JSON body must be object.')
+        return params
+    if ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'): #表单默认格式或者二进制格式
+        params = await request.post() #获取请求数据
+        return dict(**params)
+    return web.HTTPBadRequest('Unsupported Content-Type: %s' % request.content_type)
+
+#解析url?后面的参数 同名参数取第一个 names不是None时只保留这些参数
+#和parse.parse_qs(qs, True)的结果一样 只是不需要的参数不解码 没有%和+的也不解码
+def parse_query(qs, names=None):
+    kw = dict()
+    for field in qs.split('&'):
+        if not field:
+            continue
+        k, _, v = field.partition('=')
+        if '%' in k or '+' in k:
+            k = parse.unquote_plus(k)
+        if k in kw or (names is not None and k not in names):
             continue
-        if found and (param.kind != inspect.Parameter.VAR_POSITIONAL and param.kind != inspect.Parameter.KEYWORD_ONLY and param.kind != inspect.Parameter.VAR_KEYWORD):
-            raise ValueError('request parameter must be the last named parameter in function: %s%s' % (fn.__name__, str(sig)))
-    return found
+        if '%' in v or '+' in v:
+            v = parse.unquote_plus(v)
+        kw[k] = v
+    return kw
+
+#按处理函数的参数形状生成绑定函数 bind(request, params) -> 调用处理函数的kw 缺参数时返回400的响应
+#params是解析好的POST参数 没有就是None 只有路径参数的处理函数 每个请求只需要复制一下match_info
+def compile_binding(args):
+    has_request_arg = args.has_request_arg
+    if not args.reads_params:
+        if has_request_arg:
+            def bind(request, params):
+                kw = dict(request.match_info)
+                kw['request'] = request
+                return kw
+        else:
+            def bind(request, params):
+                return dict(request.match_info)
+        return bind
+    #没有**kw时 只保留处理函数声明了的关键字参数 其余的丢掉
+    names = None if args.has_var_kw_arg else frozenset(args.named_kw_args)
+    required_kw_args = args.required_kw_args
+    def bind(request, params):
+        kw = None
+        if params is not None:
+            kw = params if names is None else dict((k, v) for k, v in params.items() if k in names)
+        elif request.method == 'GET':
+            qs = request.query_string   #获取url?后面的参数
+            if qs:
+                kw = parse_query(qs, names)
+        if kw is None:
+            kw = dict(request.match_info) #None 就直接添加match_info的值
+        else:
+            # check named arg:  把match_info的值添加进去
+            for k, v in request.match_info.items():
+                if k in kw:
+                    _log.warning('Duplicate arg name in named arg and kw args: %s', k)
+                kw[k] = v
+        if has_request_arg:
+            kw['request'] = request
+        # check required kw:
+        for name in required_kw_args:
+            if not name in kw:
+                return web.HTTPBadRequest('Missing argument: %s' % name)
+        return kw
+    return bind
 
 #RequestHandler最终还是调用fn函数去处理url，不过处理url之前，因为我们想自动从request中获取参数，所以就用RequestHandler来自动获取参数**kw。
-#下面写了一大堆，都是自动获取参数而已。 就像spring mvc做的那样
+#参数怎么获取在注册路由时就编译成了绑定函数 每个请求只做这个处理函数需要的那几步 就像spring mvc做的那样
 class RequestHandler(object):
 
     def __init__(self, app, fn):
         self._app = app
         self._func = fn
+        self.__auth__ = getattr(fn, '__auth__', 'optional')    #中间件通过route_auth()读取
+        self.__cache__ = getattr(fn, '__cache__', False)       #中间件通过route_cache()读取
         #获取fn的参数详情， 只有获取了处理函数的参数，才能在request中获取争取的参数，然后调用处理函数
-        self._has_request_arg = has_request_arg(fn)
-        self._has_var_kw_arg = has_var_kw_arg(fn)
-        self._has_named_kw_args = has_named_kw_args(fn)
-        self._named_kw_args = get_named_kw_args(fn)
-        self._required_kw_args = get_required_kw_args(fn)
+        self._args = HandlerArgs(fn)
+        self._reads_params = self._args.reads_params
+        self.__query_params__ = None if self._args.has_var_kw_arg else frozenset(self._args.named_kw_args)   #route_cache_query()读取
+        self._bind = compile_binding(self._args)
 
     # 注册路由的时候，传进去的处理函数都是RequestHandler(fn)，也就是url都会调用RequestHandler()来处理，所以需要重写__call__方法
     async def __call__(self, request):
-        kw = None
-        if self._has_var_kw_arg or self._has_named_kw_args or self._required_kw_args: #处理函数 有关键字参数或**args
-            if request.method == 'POST':
-                if not request.content_type:                #请求没有设置content_type
-                    return web.HTTPBadRequest('Missing Content-Type.')
-                ct = request.content_type.lower()
-                if ct.startswith('application/json'):       #提交的内容是json格式
-                    params = await request.json()
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest('JSON body must be object.')
-                    kw = params
-                elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'): #表单默认格式或者二进制格式
-                    params = await request.post() #获取请求数据
-                    kw = dict(**params)
-                else:
-                    return web.HTTPBadRequest('Unsupported Content-Type: %s' % request.content_type)
-            if request.method == 'GET':
-                qs = request.query_string   #获取url?后面的参数
-                if qs:
-                    kw = dict()
-                    for k, v in parse.parse_qs(qs, True).items():
-                        kw[k] = v[0]
-        if kw is None:
-            kw = dict(**request.match_info) #None 就直接添加match_info的值
-        else:
-            if not self._has_var_kw_arg and self._named_kw_args: #第一个if不够精准，进一步判断，没有可变关键字参数并且有没有默认值的关键字参数
-                #删除所有有默认值的关键字参数，因为有默认值了 不需要了
-                copy = dict()
-                for name in self._named_kw_args:
-                    if name in kw:
-                        copy[name] = kw[name]
-                kw = copy
-            # check named arg:  把match_info的值添加进去
-            for k, v in request.match_info.items():
-                if k in kw:
-                    logging.warning('Duplicate arg name in named arg and kw args: %s' % k)
-                kw[k] = v
-        if self._has_request_arg:
-            kw['request'] = request
-            # check required kw:
-        if self._required_kw_args:
-            for name in self._required_kw_args:
-                if not name in kw:
-                    return web.HTTPBadRequest('Missing argument: %s' % name)
-        logging.info('call with args: %s' % str(kw))
+        params = None
+        if self._reads_params and request.method == 'POST': #处理函数 有关键字参数或**args
+            params = await read_post_params(request)
+            if isinstance(params, web.StreamResponse):
+                return params
+        kw = self._bind(request, params)
+        if isinstance(kw, web.StreamResponse):
+            return kw
+        _log.debug('call with args: %s', kw)    #参数只在调试级别打开时才格式化
         try:
-            r = await self._func(**kw)
+            r = self._func(**kw)
+            if inspect.isawaitable(r):  #@get/@post包装过的函数 是不是协程只有调用了才知道
+                r = await r
             return r
         except APIError as e:       #抛出请求的rest api有错
             return dict(error=e.error, data=e.data, message=e.message) #直接返回错误数据dict作为json
 
-#设置静态文件目录
+#静态文件 => 它有的预压缩版本的编码 每个文件只检查一次 precompress.py是部署时在启动之前运行的
+_precompressed = {}
+
+def precompressed_encodings(filename):
+    encodings = _precompressed.get(filename)
+    if encodings is None:
+        encodings = _precompressed[filename] = tuple(e for e in compress.ENCODINGS if os.path.isfile(filename + compress.PRECOMPRESSED_SUFFIX[e]))
+    return encodings
+
+#aiohttp 3.x的FileResponse会自己去找.gz/.br 而且只看Accept-Encoding里有没有这个词 不管q=0
+#用哪个编码已经由add_static()按q值协商好了 这里只发指定的那个文件
+class StaticFileResponse(web.FileResponse):
+
+    def _get_file_path_stat_encoding(self, accept_encoding):
+        return super()._get_file_path_stat_encoding('')
+
+#设置静态文件目录 浏览器支持而且有precompress.py生成的.br/.gz 就直接发压缩好的文件
+#带指纹的文件名(见assets.py)映射回原来的文件 内容和url一一对应 让浏览器缓存一年不用再确认
 def add_static(app):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-    app.router.add_static('/static/', path)
-    logging.info('add static %s => %s' % ('/static/', path))
\ No newline at end of file
+    root = os.path.realpath(path)
+    immutable = 'public, max-age=%s, immutable' % assets.MAX_AGE
+    async def static(request):
+        name = request.match_info['filename']
+        original = assets.resolve(name)
+        filename = os.path.realpath(os.path.join(root, original or name))
+        if not filename.startswith(root + os.sep) or not os.path.isfile(filename):  #不能用..跑到static外面去
+            raise web.HTTPNotFound()
+        headers = {'Cache-Control': immutable} if original is not None else {}
+        encodings = precompressed_encodings(filename)
+        if not encodings:
+            return StaticFileResponse(filename, headers=headers)
+        headers['Vary'] = 'Accept-Encoding'     #同一个url按Accept-Encoding返回不同的内容 中间的缓存要分开存
+        encoding = compress.negotiate(request.headers.get('Accept-Encoding'), encodings)
+        if encoding is None:
+            return StaticFileResponse(filename, headers=headers)
+        headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        headers['Content-Encoding'] = encoding
+        return StaticFileResponse(filename + compress.PRECOMPRESSED_SUFFIX[encoding], headers=headers)
+    app.router.add_route('GET', '/static/{filename:.+}', static)
+    app.router.add_route('HEAD', '/static/{filename:.+}', static)
+    _log.info('add static %s => %s', '/static/', path)
\ No newline at end of file
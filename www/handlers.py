@@ -2,21 +2,22 @@ from coreweb import *
 from models import *
 from apis import *
 import re, hashlib
+import orm, pagecache, session
 from config import configs
-import markdown2
+from render import render_blog, rerender_blog, blog_html, text2html, invalidate as invalidate_render
 
 COOKIE_NAME = 'awesession'
 _COOKIE_KEY = configs.session.secret
 
-@get('/')
+@get('/', cache=True)
 async def index(*, page='1'):
     page_index = get_page_index(page)
-    num = await Blog.findNumber('count(id)')
+    num = await Blog.countCached()
     p = Page(num, page_index)       #这里原本的代码没有传递页数
     if num == 0:
         blogs = []
     else:
-        blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), view='summary')
 
     return {
         '__template__': 'blogs.html',
@@ -36,7 +37,7 @@ def signin():
         '__template__' : 'signin.html'
     }
 
-@post('/api/authenticate')
+@post('/api/authenticate', auth='none')
 async def authenticate(*, email, passwd):
     if not email:
         raise APIValueError('email', 'Invalid email.')
@@ -58,13 +59,14 @@ async def authenticate(*, email, passwd):
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400) ,max_age=86400, httponly=True)
     user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = json_dumps(user)
     return r
 
-@get('/signout')
+@get('/signout', auth='none')
 def signout(request):
     referer = request.headers.get('Referer')
     r = web.HTTPFound(referer or '/')
+    session.invalidate(request.cookies.get(COOKIE_NAME))    #缓存的会话也删掉
     r.set_cookie(COOKIE_NAME, '-deleted-', max_age=0, httponly=True)    #退出就是把cookie删除
     logging.info('user signed out.')
     return r
@@ -86,6 +88,9 @@ async def cookie2user(cookie_str):
         uid, expires, sha1 = L
         if int(expires) < time.time(): #cookie过期
             return None
+        cached = session.get(cookie_str)    #验证过的cookie直接用缓存的用户
+        if cached is not None:
+            return User(**cached)
         user = await User.find(uid)
         if user is None: #用户id错误
             return None
@@ -93,7 +98,9 @@ async def cookie2user(cookie_str):
         if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():         #验证cookie是否是伪造的
             logging.info('invalid sha1')
             return None
+        user = User(**user)         #identity map里的实例同一个请求还会被find到 在副本上隐藏密码
         user.passwd = '******'      #隐藏掉密码 直接返回
+        session.put(cookie_str, uid, user, int(expires))
         return user
     except Exception as e:
         logging.exception(e)
@@ -101,7 +108,7 @@ async def cookie2user(cookie_str):
 
 _RE_EMAIL = re.compile(r'^[a-z0-9\.\-\_]+\@[a-z0-9\-\_]+(\.[a-z0-9\-\_]+){1,4}$')
 _RE_SHA1 = re.compile(r'^[0-9a-f]{40}$')
-@post('/api/users')
+@post('/api/users', auth='none')
 async def api_register_users(*, email, name, passwd):
     if not name or not name.strip():
         raise APIValueError('name')
@@ -123,17 +130,21 @@ async def api_register_users(*, email, name, passwd):
     #r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
     user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')   #这里直接自己返回了web.Response() 不用拦截器处理
+    r.body = json_dumps(user)   #这里直接自己返回了web.Response() 不用拦截器处理
     return r
 
 @get('/api/users')
-async def api_get_users(*, page='1'):
-    page_index = get_page_index(page)
-    num = await User.findNumber('count(id)')
-    p = Page(num, page_index)
-    if num == 0:
-        return dict(page=p, users=())
-    users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+async def api_get_users(*, page='1', cursor=None):
+    if cursor:
+        p, users = await find_page_by_cursor(User, cursor, view='public')
+    else:
+        page_index = get_page_index(page)
+        num = await User.countCached()
+        p = Page(num, page_index)
+        if num == 0:
+            return dict(page=p, users=())
+        users = await User.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), view='public')
+        set_page_cursors(p, users)
     for u in users:
         u.passwd = '******'
     return dict(page=p, users=users)
@@ -161,11 +172,27 @@ def get_page_index(page_str):
         p = 1
     return p
 
-#把文本变成html
-def text2html(text):
-    #每一行的前后空格去掉 然后对每一行加上p标签 &换成&amp <换&lt >换&gt
-    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
-    return ''.join(lines)
+#keyset分页 cursor是上一次返回的page.next_cursor/previous_cursor 翻到多深都不用offset
+#多查一条 用来判断这个方向上还有没有下一页
+async def find_page_by_cursor(model, cursor, page_size=5, view=None):
+    direction, key = decode_cursor(cursor)
+    if len(key) != len(model.__keyset__) or not all(isinstance(v, (str, int, float)) for v in key):
+        raise APIValueError('cursor', 'Invalid cursor.')
+    items = await model.findAll(cursor=key, reverse=(direction == 'prev'), limit=page_size + 1, view=view)
+    has_more = len(items) > page_size
+    if has_more:    #多出来的那一条离游标最远
+        items = items[1:] if direction == 'prev' else items[:page_size]
+    num = await model.countCached()
+    if items:
+        p = Page.seek(num, direction, has_more, items[0].cursorKey(), items[-1].cursorKey(), page_size)
+    else:
+        p = Page.seek(num, direction, has_more, page_size=page_size)
+    return p, items
+
+#按页码查出来的一页也带上游标 客户端可以从这一页开始改用游标翻页
+def set_page_cursors(p, items):
+    if items:
+        p.set_cursors(items[0].cursorKey(), items[-1].cursorKey())
 
 @get('/manage/blogs/create')
 def manage_create_blog():
@@ -186,7 +213,9 @@ async def api_create_blog(request, *, name, summary, content):
         raise APIValueError('content', 'content cannot be empty.')
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image,
                 name=name.strip(), summary=summary.strip(), content=content.strip())
+    await render_blog(blog)   #保存前渲染好html 读的时候就不用再渲染了
     await blog.save()
+    pagecache.invalidate('/')   #首页的每一页都往后挪了一篇
     return blog #dict 会被response转换成json web.Response()
 
 @get('/manage/')
@@ -200,28 +229,33 @@ def manage_blogs(*, page='1'):
         'page_index': get_page_index(page)
     }
 
-@get('/api/blogs')
-async def api_blogs(*, page='1'):
+@get('/api/blogs', auth='none')
+async def api_blogs(*, page='1', cursor=None):
+    if cursor:
+        p, blogs = await find_page_by_cursor(Blog, cursor, view='summary')
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)    #因为不能保证调用这个api的人传进来的page是什么 所以需要这一步
-    num = await Blog.findNumber('count(id)')
+    num = await Blog.countCached()
     p = Page(num, page_index)   #默认每页10条
     if num == 0:
         return dict(page=p, blogs=())
-    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))    #利用Page得到的分页信息去查询
+    blogs = await Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit), view='summary')    #利用Page得到的分页信息去查询
+    set_page_cursors(p, blogs)
     return dict(page=p, blogs=blogs)
 
-@get('/api/blogs/{id}')
+@get('/api/blogs/{id}', auth='none')
 async def api_get_blog(*, id):
     blog = await Blog.find(id)
     return blog
 
-@get('/blog/{id}')
+@get('/blog/{id}', cache=True)
 async def get_blog(id):
-    blog = await Blog.find(id)
-    comments = await Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
+    async with orm.connection():    #两次查询用同一个连接
+        blog = await Blog.find(id)
+        comments = await Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
     for c in comments:
         c.html_content = text2html(c.content)
-    blog.html_content = markdown2.markdown(blog.content)    #blog的内容也要转为html 这个markdown2就是专业的txt转html 上面那个我们写的就是业余的
+    blog.html_content = await blog_html(blog)    #blog的内容在保存时已经用markdown2转成html了 这里直接取 大文章现场渲染也不会阻塞事件循环
     return {
         '__template__': 'blog.html',
         'blog': blog,
@@ -232,7 +266,14 @@ async def get_blog(id):
 async def api_delete_blog(request, *, id):
     check_admin(request)
     blog = await Blog.find(id)
-    await blog.remove()
+    if blog is None:
+        raise APIResourceNotFoundError('Blog')
+    async with orm.transaction():   #博客和它的评论一起删 中途失败就都不删
+        comments = await Comment.findAll('blog_id=?', [id], fields=())
+        await blog.remove()
+        await Comment.removeAll([c.id for c in comments])
+    invalidate_render(blog.content)
+    pagecache.invalidate('/', '/blog/%s' % id)
     return dict(id=id)
 
 @get('/manage/blogs/edit')
@@ -255,8 +296,12 @@ async def api_update_blog(id, request, *, name, summary, content):
         raise APIValueError('content', 'content cannot be empty.')
     blog.name = name.strip()
     blog.summary = summary.strip()
+    if blog.content != content.strip():
+        invalidate_render(blog.content)     #内容变了 旧的渲染结果作废
     blog.content = content.strip()
+    await rerender_blog(blog)   #只重新转换改动过的块
     await blog.update()
+    pagecache.invalidate('/', '/blog/%s' % id)
     return blog
 
 #接下来是评论部分
@@ -267,28 +312,34 @@ def manage_comments(*, page='1'):
         'page_index': get_page_index(page)
     }
 
-@get('/api/comments')
-async def api_comments(*, page='1'):
+@get('/api/comments', auth='none')
+async def api_comments(*, page='1', cursor=None):
+    if cursor:
+        p, comments = await find_page_by_cursor(Comment, cursor)
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
-    num = await Comment.findNumber('count(id)')
+    num = await Comment.countCached()
     p = Page(num, page_index)
     if num == 0:
         return dict(page=p, comments=())
     comments = await Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    set_page_cursors(p, comments)
     return dict(page=p, comments=comments)
 
-@post('/api/blogs/{id}/comments')
+@post('/api/blogs/{id}/comments', auth='required')
 async def api_create_comment(id, request, *, content):
     user = request.__user__
     if user is None:
         raise APIPermissionError('Please signin first.')
     if not content or not content.strip():
         raise APIValueError('content')
-    blog = await Blog.find(id)
-    if blog is None:
-        raise APIResourceNotFoundError('Blog')
-    comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
-    await comment.save()
+    async with orm.connection():
+        blog = await Blog.find(id)
+        if blog is None:
+            raise APIResourceNotFoundError('Blog')
+        comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
+        await comment.save()
+    pagecache.invalidate('/blog/%s' % blog.id)
     return comment
 
 @post('/api/comments/{id}/delete')
@@ -298,4 +349,5 @@ async def api_delete_comments(id, request):
     if c is None:
         raise APIResourceNotFoundError('Comment')
     await c.remove()
+    pagecache.invalidate('/blog/%s' % c.blog_id)
     return dict(id=id)
\ No newline at end of file
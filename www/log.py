@@ -0,0 +1,103 @@
+import atexit, json, logging, logging.handlers, queue, random, threading
+
+#日志配置 app/backfill启动时调用一次setup() 各模块只管logging.getLogger('子系统名')
+#子系统: access(每个请求一行) api(json序列化) assets(静态文件指纹) auth(cookie验证) coreweb(路由和参数) orm(映射和批量写入) orm.sql(每条sql) render(markdown渲染) templates(jinja2渲染)
+#   levels  每个子系统单独设置级别 关掉的级别连日志记录都不会创建
+#   sample  每个子系统的采样率 只对INFO及以下生效 WARNING以上的一条都不丢
+#   queue_size  日志先放进队列 由后台线程格式化并写出 请求处理不用等磁盘/终端 队列满了就丢弃并计数 0表示同步写
+
+#只保留一部分INFO/DEBUG日志
+class SampleFilter(logging.Filter):
+
+    def __init__(self, rate):
+        super(SampleFilter, self).__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+#一行一个json 方便日志系统按字段检索
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = dict(time=round(record.created, 3), level=record.levelname, logger=record.name, message=record.getMessage())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+_LAZY_TYPES = (str, int, float, bool, type(None))
+
+#放进队列的日志 参数都是不可变的简单类型就留给后台线程格式化 否则在当前线程格式化 免得参数之后被修改
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, q):
+        super(AsyncQueueHandler, self).__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args and not (isinstance(record.args, tuple) and all(isinstance(a, _LAZY_TYPES) for a in record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:     #traceback里引用着整个调用栈 不能留到后台线程
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_handler = None
+_output = None
+_listener = None
+_lock = threading.Lock()
+
+def setup(options):
+    global _handler, _output, _listener
+    with _lock:
+        if _handler is not None:
+            return
+        if options.json:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(options.format)
+        _output = logging.StreamHandler()
+        _output.setFormatter(formatter)
+        if options.queue_size:
+            _handler = AsyncQueueHandler(queue.Queue(options.queue_size))
+            _listener = logging.handlers.QueueListener(_handler.queue, _output)
+            _listener.start()
+            atexit.register(shutdown)
+        else:
+            _handler = _output
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(options.level)
+        for name, level in options.levels.items():
+            logging.getLogger(name).setLevel(level)
+        for name, rate in options.sample.items():
+            if rate < 1:
+                logging.getLogger(name).addFilter(SampleFilter(rate))
+        logging.getLogger('log').info('logging: level=%s queue_size=%s levels=%s sample=%s' % (options.level, options.queue_size, dict(options.levels), dict(options.sample)))
+
+#把队列里剩下的日志写完 之后的日志同步写 进程退出时自动调用
+def shutdown():
+    global _handler, _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        dropped, _handler = _handler.dropped, _output
+        logging.getLogger().handlers = [_output]
+    if dropped:
+        logging.getLogger('log').warning('日志队列满 丢弃了%s条日志' % dropped)
+
+def stats():
+    if isinstance(_handler, AsyncQueueHandler):
+        return dict(queued=_handler.queue.qsize(), dropped=_handler.dropped)
+    return {}
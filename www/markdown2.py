@@ -101,6 +101,10 @@ except ImportError:
 import optparse
 from random import random, randint
 import codecs
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 
 
 #---- Python version compat
@@ -139,13 +143,18 @@ log = logging.getLogger("markdown")
 DEFAULT_TAB_WIDTH = 4
 
 
-SECRET_SALT = bytes(randint(0, 1000000))
+# `bytes(n)` on Python 3 is n zero bytes, not the digits of n, which made
+# every hash digest up to ~1MB of salt. Use the decimal digits instead.
+SECRET_SALT = str(randint(0, 1000000)).encode("utf-8")
 def _hash_text(s):
     return 'md5-' + md5(SECRET_SALT + s.encode("utf-8")).hexdigest()
 
 # Table of hash values for escaped characters:
 g_escape_table = dict([(ch, _hash_text(ch))
     for ch in '\\`*_{}[]()>#+-.!'])
+g_smarty_escape_table = dict(g_escape_table)
+g_smarty_escape_table['"'] = _hash_text('"')
+g_smarty_escape_table["'"] = _hash_text("'")
 
 
 
@@ -154,6 +163,10 @@ g_escape_table = dict([(ch, _hash_text(ch))
 class MarkdownError(Exception):
     pass
 
+class MarkdownTimeout(MarkdownError):
+    """Raised when a conversion runs past the converter's `time_budget`."""
+    pass
+
 
 
 #---- public api
@@ -165,18 +178,99 @@ def markdown_path(path, encoding="utf-8",
     fp = codecs.open(path, 'r', encoding)
     text = fp.read()
     fp.close()
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    return markdown_pool(html4tags=html4tags, tab_width=tab_width,
+                         safe_mode=safe_mode, extras=extras,
+                         link_patterns=link_patterns,
+                         use_file_vars=use_file_vars).convert(text)
 
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
              use_file_vars=False):
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    return markdown_pool(html4tags=html4tags, tab_width=tab_width,
+                         safe_mode=safe_mode, extras=extras,
+                         link_patterns=link_patterns,
+                         use_file_vars=use_file_vars).convert(text)
+
+class MarkdownPool(object):
+    r"""A pool of reusable `Markdown` converters sharing one option set.
+
+    Building a `Markdown` instance is not free (extras massaging, escape
+    table, compiled regexes), which dominates for short inputs such as
+    comments. `Markdown.convert` resets all per-document state on entry,
+    so an instance can be reused for any number of documents -- but not
+    by two threads at once. The pool hands each caller its own instance
+    for the duration of a conversion and takes it back afterwards.
+
+        >>> pool = MarkdownPool(extras=["footnotes"])
+        >>> pool.convert("*boo!*")
+        '<p><em>boo!</em></p>\n'
+    """
+    def __init__(self, max_idle=8, **options):
+        self.options = options
+        self.max_idle = max_idle
+        self.created = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        return Markdown(**self.options)
+
+    def release(self, markdowner):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(markdowner)
+
+    def convert(self, text):
+        markdowner = self.acquire()
+        try:
+            return markdowner.convert(text)
+        finally:
+            self.release(markdowner)
+
+    def convert_iter(self, text):
+        markdowner = self.acquire()
+        try:
+            for fragment in markdowner.convert_iter(text):
+                yield fragment
+        finally:
+            self.release(markdowner)
+
+# Pools keyed by option set, shared by `markdown()` and `markdown_path()`.
+# Bounded so that callers passing ever-changing options can't grow it
+# without limit; past the bound a throwaway pool is returned.
+MAX_POOLS = 32
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _options_key(html4tags, tab_width, safe_mode, extras, link_patterns,
+                 use_file_vars, time_budget=None):
+    if extras and not isinstance(extras, dict):
+        extras = dict([(e, None) for e in extras])
+    extras_key = tuple(sorted((k, repr(v)) for k, v in (extras or {}).items()))
+    return (bool(html4tags), tab_width, safe_mode, extras_key,
+            repr(link_patterns), bool(use_file_vars), time_budget)
+
+def markdown_pool(html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
+                  safe_mode=None, extras=None, link_patterns=None,
+                  use_file_vars=False, time_budget=None):
+    """Return the shared `MarkdownPool` for the given option set."""
+    key = _options_key(html4tags, tab_width, safe_mode, extras,
+                       link_patterns, use_file_vars, time_budget)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = MarkdownPool(html4tags=html4tags, tab_width=tab_width,
+                            safe_mode=safe_mode, extras=extras,
+                            link_patterns=link_patterns,
+                            use_file_vars=use_file_vars,
+                            time_budget=time_budget)
+        with _pools_lock:
+            if len(_pools) < MAX_POOLS:
+                pool = _pools.setdefault(key, pool)
+    return pool
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -197,10 +291,16 @@ class Markdown(object):
     # (see _ProcessListItems() for details):
     list_level = 0
 
+    # Blockquotes and lists nested deeper than this are left as plain
+    # paragraphs: each level re-runs the block gamut over the rest of the
+    # text, so unbounded nesting is both slow and a recursion overflow.
+    max_nesting = 32
+
     _ws_only_line_re = re.compile(r"^[ \t]+$", re.M)
 
     def __init__(self, html4tags=False, tab_width=4, safe_mode=None,
-                 extras=None, link_patterns=None, use_file_vars=False):
+                 extras=None, link_patterns=None, use_file_vars=False,
+                 time_budget=None):
         if html4tags:
             self.empty_element_suffix = ">"
         else:
@@ -231,12 +331,17 @@ class Markdown(object):
 
         self.link_patterns = link_patterns
         self.use_file_vars = use_file_vars
-        self._outdent_re = re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+        # Seconds a single `convert()` may take before `MarkdownTimeout`
+        # is raised, or None for no limit.
+        self.time_budget = time_budget
+        self._outdent_re = _outdent_re_from_tab_width(tab_width)
 
-        self._escape_table = g_escape_table.copy()
+        # `_encode_code` adds code-span entries to the escape table, so it
+        # is per-document state: `reset()` copies it from this base.
         if "smarty-pants" in self.extras:
-            self._escape_table['"'] = _hash_text('"')
-            self._escape_table["'"] = _hash_text("'")
+            self._base_escape_table = g_smarty_escape_table
+        else:
+            self._base_escape_table = g_escape_table
 
     def reset(self):
         self.urls = {}
@@ -244,7 +349,13 @@ class Markdown(object):
         self.html_blocks = {}
         self.html_spans = {}
         self.list_level = 0
+        self._block_depth = 0
+        if self.time_budget:
+            self._deadline = time.time() + self.time_budget
+        else:
+            self._deadline = None
         self.extras = self._instance_extras.copy()
+        self._escape_table = self._base_escape_table.copy()
         if "footnotes" in self.extras:
             self.footnotes = {}
             self.footnote_ids = []
@@ -252,11 +363,16 @@ class Markdown(object):
             self._count_from_header_id = {} # no `defaultdict` in Python 2.4
         if "metadata" in self.extras:
             self.metadata = {}
+        if "toc" in self.extras:
+            self._toc = None
 
     # Per <https://developer.mozilla.org/en-US/docs/HTML/Element/a> "rel"
     # should only be used in <a> tags with an "href" attribute.
     _a_nofollow = re.compile(r"<(a)([^>]*href=)", re.IGNORECASE)
 
+    _extras_splitter_re = re.compile("[ ,]+")
+    _line_ending_re = re.compile("\r\n|\r")
+
     def convert(self, text):
         """Convert the given text."""
         # Main function. The order in which other subs are called here is
@@ -264,6 +380,59 @@ class Markdown(object):
         # _EscapeSpecialChars(), so that any *'s or _'s in the <a>
         # and <img> tags get encoded.
 
+        text = self._convert_prelude(text)
+
+        text = self._run_block_gamut(text)
+
+        if "footnotes" in self.extras:
+            text = self._add_footnotes(text)
+
+        text = self._convert_finish(text)
+
+        text += "\n"
+
+        rv = UnicodeWithAttrs(text)
+        if "toc" in self.extras:
+            rv._toc = self._toc
+        if "metadata" in self.extras:
+            rv.metadata = self.metadata
+        return rv
+
+    def convert_iter(self, text):
+        """Convert the given text, yielding the HTML one top-level block
+        at a time.
+
+        Link definitions and footnotes are collected from the whole
+        document first, so the joined fragments are identical to
+        `convert(text)`, but the block and span passes and the final
+        unescaping never hold a copy of the whole document's HTML.
+        The toc and metadata are not yielded: read them off this
+        instance (`_toc`, `metadata`) once the generator is exhausted.
+        """
+        text = self._convert_prelude(text)
+
+        sep = ""
+        for block in self._iter_top_level_blocks(text):
+            fragment = sep + self._convert_finish(self._run_block_gamut(block))
+            paused = time.time()
+            yield fragment
+            if self._deadline is not None:
+                # Time spent waiting on the consumer doesn't count against
+                # `time_budget`.
+                self._deadline += time.time() - paused
+            sep = "\n\n"
+
+        if "footnotes" in self.extras:
+            footer = self._footnotes_html()
+            if footer:
+                yield self._convert_finish("\n\n" + footer)
+
+        yield "\n"
+
+    def _convert_prelude(self, text):
+        # The whole-document first pass: everything up to (and including)
+        # stripping link and footnote definitions.
+
         # Clear the global hashes. If we don't clear these, you get conflicts
         # from other articles when generating a page which contains more than
         # one article (e.g. an index page that shows the N most recent
@@ -278,8 +447,7 @@ class Markdown(object):
             # Look for emacs-style file variable hints.
             emacs_vars = self._get_emacs_vars(text)
             if "markdown-extras" in emacs_vars:
-                splitter = re.compile("[ ,]+")
-                for e in splitter.split(emacs_vars["markdown-extras"]):
+                for e in self._extras_splitter_re.split(emacs_vars["markdown-extras"]):
                     if '=' in e:
                         ename, earg = e.split('=', 1)
                         try:
@@ -291,7 +459,7 @@ class Markdown(object):
                     self.extras[ename] = earg
 
         # Standardize line endings:
-        text = re.sub("\r\n|\r", "\n", text)
+        text = self._line_ending_re.sub("\n", text)
 
         # Make sure $text ends with a couple of newlines:
         text += "\n\n"
@@ -331,11 +499,11 @@ class Markdown(object):
             text = self._strip_footnote_definitions(text)
         text = self._strip_link_definitions(text)
 
-        text = self._run_block_gamut(text)
-
-        if "footnotes" in self.extras:
-            text = self._add_footnotes(text)
+        return text
 
+    def _convert_finish(self, text):
+        # Applied to the block gamut output; works on any run of whole
+        # top-level blocks, not just the full document.
         text = self.postprocess(text)
 
         text = self._unescape_special_chars(text)
@@ -346,14 +514,42 @@ class Markdown(object):
         if "nofollow" in self.extras:
             text = self._a_nofollow.sub(r'<\1 rel="nofollow"\2', text)
 
-        text += "\n"
+        return text
 
-        rv = UnicodeWithAttrs(text)
-        if "toc" in self.extras:
-            rv._toc = self._toc
-        if "metadata" in self.extras:
-            rv.metadata = self.metadata
-        return rv
+    # A new top-level block can start after a blank line at a column-0
+    # character that can't belong to the previous block: not indented
+    # code or a list item continuation, and not a list marker, blockquote,
+    # table row, HTML or code fence. Digits are excluded altogether
+    # because of ordered lists.
+    _block_boundary_re = re.compile(r'\n\n+(?=[^\s\d<>*+|`~=-])')
+
+    # A list item marker followed by nothing but whitespace. The list
+    # regexes need at least one character of item text after the marker's
+    # whitespace, so such an item swallows the blank line and the
+    # paragraph after it: '1. \n\npara' is one list, not a list and a
+    # paragraph. Never split right after one.
+    _empty_list_item_re = re.compile(r'[ \t]*(?:[*+-]|\d+\.)[ \t]+\Z')
+
+    def _iter_top_level_blocks(self, text):
+        # Split the first-pass text at safe block boundaries. Each block
+        # keeps its trailing newlines, as the block regexes expect.
+        start = pos = 0
+        open_pre = 0
+        for match in self._block_boundary_re.finditer(text):
+            end = match.end()
+            # Code blocks that aren't hashed yet (fenced code blocks in
+            # safe mode) can hold blank lines: never split inside a <pre>.
+            open_pre += text.count("<pre", pos, end) - text.count("</pre>", pos, end)
+            pos = end
+            if open_pre > 0 or match.start() == start:
+                # (the latter: nothing but leading newlines so far)
+                continue
+            line_start = max(start, text.rfind("\n", start, match.start()) + 1)
+            if self._empty_list_item_re.match(text, line_start, match.start()):
+                continue
+            yield text[start:end]
+            start = end
+        yield text[start:]
 
     def postprocess(self, text):
         """A hook for subclasses to do some postprocessing of the html, if
@@ -543,39 +739,25 @@ class Markdown(object):
     _block_tags_a = 'p|div|h[1-6]|blockquote|pre|table|dl|ol|ul|script|noscript|form|fieldset|iframe|math|ins|del'
     _block_tags_a += _html5tags
 
-    _strict_tag_block_re = re.compile(r"""
-        (                       # save in \1
-            ^                   # start of line  (with re.M)
-            <(%s)               # start tag = \2
-            \b                  # word break
-            (.*\n)*?            # any number of lines, minimally matching
-            </\2>               # the matching end tag
-            [ \t]*              # trailing spaces/tabs
-            (?=\n+|\Z)          # followed by a newline or end of document
-        )
-        """ % _block_tags_a,
-        re.X | re.M)
-
     _block_tags_b = 'p|div|h[1-6]|blockquote|pre|table|dl|ol|ul|script|noscript|form|fieldset|iframe|math'
     _block_tags_b += _html5tags
 
-    _liberal_tag_block_re = re.compile(r"""
-        (                       # save in \1
-            ^                   # start of line  (with re.M)
-            <(%s)               # start tag = \2
-            \b                  # word break
-            (.*\n)*?            # any number of lines, minimally matching
-            .*</\2>             # the matching end tag
-            [ \t]*              # trailing spaces/tabs
-            (?=\n+|\Z)          # followed by a newline or end of document
-        )
-        """ % _block_tags_b,
-        re.X | re.M)
+    # Upstream markdown2 matches a tag block with one regex:
+    # `^<(tags)\b(.*\n)*?</\2>[ \t]*(?=\n+|\Z)` (strict, `_block_tags_a`)
+    # or the same with `.*</\2>` (liberal, `_block_tags_b`).
+    # `_sub_tag_blocks()` does what those do without their quadratic
+    # worst case.
+    _strict_tag_opener_re = re.compile(r"^<(%s)\b" % _block_tags_a, re.M)
+    _strict_tag_closer_re = re.compile(r"</(%s)>[ \t]*(?=\n|\Z)" % _block_tags_a)
+    _liberal_tag_opener_re = re.compile(r"^<(%s)\b" % _block_tags_b, re.M)
+    _liberal_tag_closer_re = re.compile(r"</(%s)>[ \t]*(?=\n|\Z)" % _block_tags_b)
 
     _html_markdown_attr_re = re.compile(
         r'''\s+markdown=("1"|'1')''')
     def _hash_html_block_sub(self, match, raw=False):
-        html = match.group(1)
+        return self._hash_html_block(match.group(1), raw)
+
+    def _hash_html_block(self, html, raw=False):
         if raw and self.safe_mode:
             html = self._sanitize_html(html)
         elif 'markdown-in-html' in self.extras and 'markdown=' in html:
@@ -626,10 +808,12 @@ class Markdown(object):
         # the inner nested divs must be indented.
         # We need to do this before the next, more liberal match, because the next
         # match will start at the first `<div>` and stop at the first `</div>`.
-        text = self._strict_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._sub_tag_blocks(text, self._strict_tag_opener_re,
+                                    self._strict_tag_closer_re, True, raw)
 
         # Now match more liberally, simply from `\n<tag>` to `</tag>\n`
-        text = self._liberal_tag_block_re.sub(hash_html_block_sub, text)
+        text = self._sub_tag_blocks(text, self._liberal_tag_opener_re,
+                                    self._liberal_tag_closer_re, False, raw)
 
         # Special case just for <hr />. It was easier to make a special
         # case than to make the other regex more complicated.
@@ -705,31 +889,57 @@ class Markdown(object):
 
         return text
 
+
+    def _sub_tag_blocks(self, text, opener_re, closer_re, strict, raw):
+        # Same result as the strict or liberal tag block regex (see
+        # `_strict_tag_opener_re`), in O(n log n). The regexes
+        # scan from every opening tag to the end of the text when there's
+        # no closing tag for it ("<div>\n" * n). Here the closing tags
+        # that can end a block -- those at the end of a line -- are found
+        # once, and each opening tag looks up its closer with a bisect.
+        # A strict block's closing tag also has to start its line (or
+        # directly follow the opening tag's name).
+        if '</' not in text:
+            return text
+        closers = {}    # tag -> sorted closer positions
+        ends = {}       # closer position -> (tag, end of match)
+        for m in closer_re.finditer(text):
+            c, tag = m.start(), m.group(1)
+            ends[c] = (tag, m.end())
+            if not strict or c == 0 or text[c-1] == '\n':
+                closers.setdefault(tag, []).append(c)
+        if not ends:
+            return text
+
+        parts = []
+        pos = 0
+        for m in opener_re.finditer(text):
+            start, tag, after = m.start(), m.group(1), m.end()
+            if start < pos:
+                continue
+            if strict and ends.get(after, (None,))[0] == tag:
+                end = ends[after][1]
+            else:
+                found = closers.get(tag)
+                if not found:
+                    continue
+                j = bisect_left(found, after)
+                if j == len(found):
+                    continue
+                end = ends[found[j]][1]
+            parts.append(text[pos:start])
+            parts.append(self._hash_html_block(text[start:end], raw))
+            pos = end
+        parts.append(text[pos:])
+        return ''.join(parts)
+
     def _strip_link_definitions(self, text):
         # Strips link definitions from text, stores the URLs and titles in
         # hash references.
-        less_than_tab = self.tab_width - 1
 
         # Link defs are in the form:
         #   [id]: url "optional title"
-        _link_def_re = re.compile(r"""
-            ^[ ]{0,%d}\[(.+)\]: # id = \1
-              [ \t]*
-              \n?               # maybe *one* newline
-              [ \t]*
-            <?(.+?)>?           # url = \2
-              [ \t]*
-            (?:
-                \n?             # maybe one newline
-                [ \t]*
-                (?<=\s)         # lookbehind for whitespace
-                ['"(]
-                ([^\n]*)        # title = \3
-                ['")]
-                [ \t]*
-            )?  # title is optional
-            (?:\n+|\Z)
-            """ % less_than_tab, re.X | re.M | re.U)
+        _link_def_re = _link_def_re_from_tab_width(self.tab_width)
         return _link_def_re.sub(self._extract_link_def_sub, text)
 
     def _extract_link_def_sub(self, match):
@@ -740,10 +950,12 @@ class Markdown(object):
             self.titles[key] = title
         return ""
 
+    _non_word_re = re.compile(r'\W')
+
     def _extract_footnote_def_sub(self, match):
         id, text = match.groups()
         text = _dedent(text, skip_first_line=not text.startswith('\n')).strip()
-        normed_id = re.sub(r'\W', '-', id)
+        normed_id = self._non_word_re.sub('-', id)
         # Ensure footnote text ends with a couple newlines (for some
         # block gamut matches).
         self.footnotes[normed_id] = text + "\n\n"
@@ -764,30 +976,25 @@ class Markdown(object):
             [^note-id]:
                 Text of the note.
         """
-        less_than_tab = self.tab_width - 1
-        footnote_def_re = re.compile(r'''
-            ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
-            [ \t]*
-            (                       # footnote text = \2
-              # First line need not start with the spaces.
-              (?:\s*.*\n+)
-              (?:
-                (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
-                .*\n+
-              )*
-            )
-            # Lookahead for non-space at line-start, or end of doc.
-            (?:(?=^[ ]{0,%d}\S)|\Z)
-            ''' % (less_than_tab, self.tab_width, self.tab_width),
-            re.X | re.M)
+        footnote_def_re = _footnote_def_re_from_tab_width(self.tab_width)
         return footnote_def_re.sub(self._extract_footnote_def_sub, text)
 
     _hr_re = re.compile(r'^[ ]{0,3}([-_*][ ]{0,2}){3,}$', re.M)
 
+    def _check_time_budget(self):
+        if self._deadline is not None and time.time() > self._deadline:
+            raise MarkdownTimeout("conversion took longer than %ss"
+                                  % self.time_budget)
+
     def _run_block_gamut(self, text):
         # These are all the transformations that form block-level
         # tags like paragraphs, headers, and list items.
 
+        self._check_time_budget()
+        if self._block_depth >= self.max_nesting:
+            return self._form_paragraphs(text)
+        self._block_depth += 1
+
         if "fenced-code-blocks" in self.extras:
             text = self._do_fenced_code_blocks(text)
 
@@ -799,7 +1006,7 @@ class Markdown(object):
         # Markdown.pl 1.0.1's hr regexes limit the number of spaces between the
         # hr chars to one or two. We'll reproduce that limit here.
         hr = "\n<hr"+self.empty_element_suffix+"\n"
-        text = re.sub(self._hr_re, hr, text)
+        text = self._hr_re.sub(hr, text)
 
         text = self._do_lists(text)
 
@@ -822,6 +1029,7 @@ class Markdown(object):
 
         text = self._form_paragraphs(text)
 
+        self._block_depth -= 1
         return text
 
     def _pyshell_block_sub(self, match):
@@ -840,12 +1048,7 @@ class Markdown(object):
         if ">>>" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        _pyshell_block_re = re.compile(r"""
-            ^([ ]{0,%d})>>>[ ].*\n   # first line
-            ^(\1.*\S+.*\n)*         # any number of subsequent lines
-            ^\n                     # ends with a blank line
-            """ % less_than_tab, re.M | re.X)
+        _pyshell_block_re = _pyshell_block_re_from_tab_width(self.tab_width)
 
         return _pyshell_block_re.sub(self._pyshell_block_sub, text)
 
@@ -894,38 +1097,18 @@ class Markdown(object):
         """Copying PHP-Markdown and GFM table syntax. Some regex borrowed from
         https://github.com/michelf/php-markdown/blob/lib/Michelf/Markdown.php#L2538
         """
-        less_than_tab = self.tab_width - 1
-        table_re = re.compile(r'''
-                (?:(?<=\n\n)|\A\n?)             # leading blank line
-
-                ^[ ]{0,%d}                      # allowed whitespace
-                (.*[|].*)  \n                   # $1: header row (at least one pipe)
-
-                ^[ ]{0,%d}                      # allowed whitespace
-                (                               # $2: underline row
-                    # underline row with leading bar
-                    (?:  \|\ *:?-+:?\ *  )+  \|?  \n
-                    |
-                    # or, underline row without leading bar
-                    (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
-                )
-
-                (                               # $3: data rows
-                    (?:
-                        ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
-                        .*\|.*  \n
-                    )+
-                )
-            ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+        table_re = _table_re_from_tab_width(self.tab_width)
         return table_re.sub(self._table_sub, text)
 
+    _wiki_cell_sep_re = re.compile(r'(?<!\\)\|\|')
+
     def _wiki_table_sub(self, match):
         ttext = match.group(0).strip()
         #print 'wiki table: %r' % match.group(0)
         rows = []
         for line in ttext.splitlines(0):
             line = line.strip()[2:-2].strip()
-            row = [c.strip() for c in re.split(r'(?<!\\)\|\|', line)]
+            row = [c.strip() for c in self._wiki_cell_sep_re.split(line)]
             rows.append(row)
         #pprint(rows)
         hlines = ['<table>', '<tbody>']
@@ -945,18 +1128,18 @@ class Markdown(object):
         if "||" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        wiki_table_re = re.compile(r'''
-            (?:(?<=\n\n)|\A\n?)            # leading blank line
-            ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
-            (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
-            ''' % less_than_tab, re.M | re.X)
+        wiki_table_re = _wiki_table_re_from_tab_width(self.tab_width)
         return wiki_table_re.sub(self._wiki_table_sub, text)
 
+    _break_on_newline_re = re.compile(r" *\n")
+    _hard_break_re = re.compile(r" {2,}\n")
+
     def _run_span_gamut(self, text):
         # These are all the transformations that occur *within* block-level
         # tags like paragraphs, headers, and list items.
 
+        self._check_time_budget()
+
         text = self._do_code_spans(text)
 
         text = self._escape_special_chars(text)
@@ -981,9 +1164,9 @@ class Markdown(object):
 
         # Do hard breaks:
         if "break-on-newline" in self.extras:
-            text = re.sub(r" *\n", "<br%s\n" % self.empty_element_suffix, text)
+            text = self._break_on_newline_re.sub("<br%s\n" % self.empty_element_suffix, text)
         else:
-            text = re.sub(r" {2,}\n", " <br%s\n" % self.empty_element_suffix, text)
+            text = self._hard_break_re.sub(" <br%s\n" % self.empty_element_suffix, text)
 
         return text
 
@@ -1005,6 +1188,15 @@ class Markdown(object):
         )
         """, re.X)
 
+    def _sorta_html_tokenize(self, text):
+        # `self._sorta_html_tokenize_re.split(text)`. Every token ends with
+        # ">", so nothing past the last one is split: without the cut, each
+        # "<" of "<http://" * n is tried against the whole rest of the text.
+        end = text.rfind('>') + 1
+        tokens = self._sorta_html_tokenize_re.split(text[:end])
+        tokens[-1] += text[end:]
+        return tokens
+
     def _escape_special_chars(self, text):
         # Python markdown note: the HTML tokenization here differs from
         # that in Markdown.pl, hence the behaviour for subtle cases can
@@ -1014,7 +1206,7 @@ class Markdown(object):
         # here.
         escaped = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._sorta_html_tokenize(text):
             if is_html_markup:
                 # Within tags/HTML-comments/auto-links, encode * and _
                 # so they don't conflict with their use in Markdown for
@@ -1041,7 +1233,7 @@ class Markdown(object):
 
         tokens = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._sorta_html_tokenize(text):
             if is_html_markup and not _is_auto_link(token):
                 sanitized = self._sanitize_html(token)
                 key = _hash_text(sanitized)
@@ -1102,13 +1294,25 @@ class Markdown(object):
         match = self._whitespace.match(text, start)
         return match.end()
 
-    def _find_balanced(self, text, start, open_c, close_c):
+    def _find_balanced(self, text, start, open_c, close_c, unbalanced=None):
         """Returns the index where the open_c and close_c characters balance
         out - the same number of open_c and close_c are encountered - or the
         end of string if it's reached before the balance point is found.
+
+        `unbalanced` is an optional dict in which `_do_links` keeps what a
+        scan that ran off the end learned about the rest of the text, so
+        that scanning on from every "(" of "[a](" * n is not quadratic.
         """
-        i = start
         l = len(text)
+        if unbalanced is not None and open_c in unbalanced:
+            tails, lows, covered = unbalanced[open_c]
+            if l - start <= covered:
+                # `lows` is keyed by the length of the text from each
+                # open_c/close_c on: the lowest the count gets from there.
+                j = bisect_right(tails, l - start) - 1
+                if j < 0 or lows[j] >= 0:
+                    return l
+        i = start
         count = 1
         while count > 0 and i < l:
             if text[i] == open_c:
@@ -1116,9 +1320,23 @@ class Markdown(object):
             elif text[i] == close_c:
                 count -= 1
             i += 1
+        if count > 0 and unbalanced is not None:
+            chars_re = _balanced_chars_re(open_c, close_c)
+            tails, lows = [], []
+            low = 0
+            for m in reversed(list(chars_re.finditer(text, start))):
+                low = min(0, low + (1 if m.group() == open_c else -1))
+                tails.append(l - m.start())
+                lows.append(low)
+            unbalanced[open_c] = (tails, lows, l - start)
         return i
 
-    def _extract_url_and_title(self, text, start):
+    def _forget_unbalanced(self, unbalanced, tail):
+        # `_do_links` rewrote the text before its last `tail` characters.
+        for open_c, (tails, lows, covered) in list(unbalanced.items()):
+            unbalanced[open_c] = (tails, lows, min(covered, tail))
+
+    def _extract_url_and_title(self, text, start, unbalanced=None):
         """Extracts the url and (optional) title from the tail of a link"""
         # text[start] equals the opening parenthesis
         idx = self._find_non_whitespace(text, start+1)
@@ -1127,8 +1345,12 @@ class Markdown(object):
         end_idx = idx
         has_anglebrackets = text[idx] == "<"
         if has_anglebrackets:
-            end_idx = self._find_balanced(text, end_idx+1, "<", ">")
-        end_idx = self._find_balanced(text, end_idx, "(", ")")
+            end_idx = self._find_balanced(text, end_idx+1, "<", ">", unbalanced)
+        end_idx = self._find_balanced(text, end_idx, "(", ")", unbalanced)
+        if end_idx == len(text) and not (text.endswith(")") or text.endswith(")\n")):
+            # Unbalanced: the title regex below could only match at the
+            # very end of the text.
+            return None, None, None
         match = self._inline_link_title.search(text, idx, end_idx)
         if not match:
             return None, None, None
@@ -1153,6 +1375,9 @@ class Markdown(object):
         # pos must be `>= anchor_allowed_pos`.
         anchor_allowed_pos = 0
 
+        # See `_find_balanced()`.
+        unbalanced = {}
+
         curr_pos = 0
         while True: # Handle the next link.
             # The next '[' is the start of:
@@ -1175,6 +1400,7 @@ class Markdown(object):
             except ValueError:
                 break
             text_length = len(text)
+            self._check_time_budget()
 
             # Find the matching closing ']'.
             # Markdown.pl allows *matching* brackets in link text so we
@@ -1182,8 +1408,12 @@ class Markdown(object):
             # matching brackets in img alt text -- we'll differ in that
             # regard.
             bracket_depth = 0
-            for p in range(start_idx+1, min(start_idx+MAX_LINK_TEXT_SENTINEL,
-                                            text_length)):
+            scan_end = min(start_idx+MAX_LINK_TEXT_SENTINEL, text_length)
+            if text.find(']', start_idx+1, scan_end) == -1:
+                # No ']' at all: skip the char-by-char scan below.
+                curr_pos = start_idx + 1
+                continue
+            for p in range(start_idx+1, scan_end):
                 ch = text[p]
                 if ch == ']':
                     bracket_depth -= 1
@@ -1200,12 +1430,13 @@ class Markdown(object):
 
             # Possibly a footnote ref?
             if "footnotes" in self.extras and link_text.startswith("^"):
-                normed_id = re.sub(r'\W', '-', link_text[1:])
+                normed_id = self._non_word_re.sub('-', link_text[1:])
                 if normed_id in self.footnotes:
                     self.footnote_ids.append(normed_id)
                     result = '<sup class="footnote-ref" id="fnref-%s">' \
                              '<a href="#fn-%s">%s</a></sup>' \
                              % (normed_id, normed_id, len(self.footnote_ids))
+                    self._forget_unbalanced(unbalanced, text_length - (p+1))
                     text = text[:start_idx] + result + text[p+1:]
                 else:
                     # This id isn't defined, leave the markup alone.
@@ -1219,7 +1450,7 @@ class Markdown(object):
 
             # Inline anchor or img?
             if text[p] == '(': # attempt at perf improvement
-                url, title, url_end_idx = self._extract_url_and_title(text, p)
+                url, title, url_end_idx = self._extract_url_and_title(text, p, unbalanced)
                 if url is not None:
                     # Handle an inline anchor or img.
                     is_img = start_idx > 0 and text[start_idx-1] == "!"
@@ -1246,6 +1477,7 @@ class Markdown(object):
                         if "smarty-pants" in self.extras:
                             result = result.replace('"', self._escape_table['"'])
                         curr_pos = start_idx + len(result)
+                        self._forget_unbalanced(unbalanced, text_length - url_end_idx)
                         text = text[:start_idx] + result + text[url_end_idx:]
                     elif start_idx >= anchor_allowed_pos:
                         result_head = '<a href="%s"%s>' % (url, title_str)
@@ -1256,6 +1488,7 @@ class Markdown(object):
                         # anchor_allowed_pos on.
                         curr_pos = start_idx + len(result_head)
                         anchor_allowed_pos = start_idx + len(result)
+                        self._forget_unbalanced(unbalanced, text_length - url_end_idx)
                         text = text[:start_idx] + result + text[url_end_idx:]
                     else:
                         # Anchor not allowed here.
@@ -1297,6 +1530,7 @@ class Markdown(object):
                             if "smarty-pants" in self.extras:
                                 result = result.replace('"', self._escape_table['"'])
                             curr_pos = start_idx + len(result)
+                            self._forget_unbalanced(unbalanced, text_length - match.end())
                             text = text[:start_idx] + result + text[match.end():]
                         elif start_idx >= anchor_allowed_pos:
                             result = '<a href="%s"%s>%s</a>' \
@@ -1309,6 +1543,7 @@ class Markdown(object):
                             # anchor_allowed_pos on.
                             curr_pos = start_idx + len(result_head)
                             anchor_allowed_pos = start_idx + len(result)
+                            self._forget_unbalanced(unbalanced, text_length - match.end())
                             text = text[:start_idx] + result + text[match.end():]
                         else:
                             # Anchor not allowed here.
@@ -1429,6 +1664,8 @@ class Markdown(object):
 
     def _do_lists(self, text):
         # Form HTML ordered (numbered) and unordered (bulleted) lists.
+        if self.list_level >= self.max_nesting:
+            return text
 
         # Iterate over each *non-overlapping* list match.
         pos = 0
@@ -1438,33 +1675,8 @@ class Markdown(object):
             # types running into each other (see issue #16).
             hits = []
             for marker_pat in (self._marker_ul, self._marker_ol):
-                less_than_tab = self.tab_width - 1
-                whole_list = r'''
-                    (                   # \1 = whole list
-                      (                 # \2
-                        [ ]{0,%d}
-                        (%s)            # \3 = first list item marker
-                        [ \t]+
-                        (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
-                      )
-                      (?:.+?)
-                      (                 # \4
-                          \Z
-                        |
-                          \n{2,}
-                          (?=\S)
-                          (?!           # Negative lookahead for another list item marker
-                            [ \t]*
-                            %s[ \t]+
-                          )
-                      )
-                    )
-                ''' % (less_than_tab, marker_pat, marker_pat)
-                if self.list_level:  # sub-list
-                    list_re = re.compile("^"+whole_list, re.X | re.M | re.S)
-                else:
-                    list_re = re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
-                                         re.X | re.M | re.S)
+                list_re = _list_re_from_tab_width(self.tab_width, marker_pat,
+                                                  bool(self.list_level))
                 match = list_re.search(text, pos)
                 if match:
                     hits.append((match.start(), match))
@@ -1632,20 +1844,7 @@ class Markdown(object):
 
     def _do_code_blocks(self, text):
         """Process Markdown `<pre><code>` blocks."""
-        code_block_re = re.compile(r'''
-            (?:\n\n|\A\n?)
-            (               # $1 = the code block -- one or more lines, starting with a space/tab
-              (?:
-                (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
-                .*\n+
-              )+
-            )
-            ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
-            # Lookahead to make sure this block isn't already in a code block.
-            # Needed when syntax highlighting is being used.
-            (?![^<]*\</code\>)
-            ''' % (self.tab_width, self.tab_width),
-            re.M | re.X)
+        code_block_re = _code_block_re_from_tab_width(self.tab_width)
         return code_block_re.sub(self._code_block_sub, text)
 
     _fenced_code_block_re = re.compile(r'''
@@ -1670,21 +1869,13 @@ class Markdown(object):
     #   space and that space will be removed in the emitted HTML
     # See `test/tm-cases/escapes.text` for a number of edge-case
     # examples.
-    _code_span_re = re.compile(r'''
-            (?<!\\)
-            (`+)        # \1 = Opening run of `
-            (?!`)       # See Note A test/tm-cases/escapes.text
-            (.+?)       # \2 = The code block
-            (?<!`)
-            \1          # Matching closer
-            (?!`)
-        ''', re.X | re.S)
-
     def _code_span_sub(self, match):
         c = match.group(2).strip(" \t")
         c = self._encode_code(c)
         return "<code>%s</code>" % c
 
+    _backtick_run_re = re.compile(r"`+")
+
     def _do_code_spans(self, text):
         #   *   Backtick quotes are used for <code></code> spans.
         #
@@ -1708,7 +1899,44 @@ class Markdown(object):
         #       Turns to:
         #
         #         ... type <code>`bar`</code> ...
-        return self._code_span_re.sub(self._code_span_sub, text)
+        #
+        # Same result as upstream's regex
+        # `(?<!\\)(`+)(?!`)(.+?)(?<!`)\1(?!`)` (re.S) with
+        # `_code_span_sub`, but in O(n log n): the regex tries every
+        # backtick as an opener against the rest of the text, which is
+        # quadratic when runs don't close. A closer is a maximal run of
+        # exactly the opener's length, so the runs are indexed by length
+        # and looked up with a bisect.
+        if '`' not in text:
+            return text
+        runs = [(m.start(), m.end()) for m in self._backtick_run_re.finditer(text)]
+        starts_by_length = {}
+        for start, end in runs:
+            starts_by_length.setdefault(end - start, []).append(start)
+
+        parts = []
+        pos = 0
+        for start, end in runs:
+            if start < pos:
+                continue
+            # Every backtick of the run can open (with the rest of the
+            # run as the opening delimiter), except an escaped first one.
+            for i in range(start, end):
+                if i == start and i > 0 and text[i-1] == '\\':
+                    continue
+                closers = starts_by_length.get(end - i)
+                if not closers:
+                    continue
+                j = bisect_left(closers, end + 1)
+                if j < len(closers):
+                    close = closers[j]
+                    c = self._encode_code(text[end:close].strip(" \t"))
+                    parts.append(text[pos:i])
+                    parts.append("<code>%s</code>" % c)
+                    pos = close + end - i
+                    break
+        parts.append(text[pos:])
+        return ''.join(parts)
 
     def _encode_code(self, text):
         """Encode/escape certain characters inside Markdown code runs.
@@ -1729,20 +1957,68 @@ class Markdown(object):
         self._escape_table[text] = hashed
         return hashed
 
-    _strong_re = re.compile(r"(\*\*|__)(?=\S)(.+?[*_]*)(?<=\S)\1", re.S)
-    _em_re = re.compile(r"(\*|_)(?=\S)(.+?)(?<=\S)\1", re.S)
-    _code_friendly_strong_re = re.compile(r"\*\*(?=\S)(.+?[*_]*)(?<=\S)\*\*", re.S)
-    _code_friendly_em_re = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*", re.S)
+    _emphasis_run_re = re.compile(r"[*_]*")
+
     def _do_italics_and_bold(self, text):
         # <strong> must go first:
         if "code-friendly" in self.extras:
-            text = self._code_friendly_strong_re.sub(r"<strong>\1</strong>", text)
-            text = self._code_friendly_em_re.sub(r"<em>\1</em>", text)
+            text = self._sub_emphasis(text, ("**",), "strong")
+            text = self._sub_emphasis(text, ("*",), "em")
         else:
-            text = self._strong_re.sub(r"<strong>\2</strong>", text)
-            text = self._em_re.sub(r"<em>\2</em>", text)
+            text = self._sub_emphasis(text, ("**", "__"), "strong")
+            text = self._sub_emphasis(text, ("*", "_"), "em")
         return text
 
+    def _sub_emphasis(self, text, delims, tag):
+        # Same result as substituting with upstream's regexes, in
+        # O(n log n): strong is `(\*\*|__)(?=\S)(.+?[*_]*)(?<=\S)\1`, em
+        # is `(\*|_)(?=\S)(.+?)(?<=\S)\1` (re.S; code-friendly allows only
+        # `*`). The regexes run a lazy `.+?` from every opener to the end
+        # of the text when it doesn't close ("*a " * n), which is
+        # quadratic. Here the valid closer positions -- a delimiter after
+        # a non-space -- are found once, and each opener looks up its
+        # closer with a bisect.
+        width = len(delims[0])
+        closers = {}
+        openers = []
+        for d in delims:
+            closers[d] = found = []
+            p = text.find(d)
+            while p != -1:
+                if p > 0 and not text[p-1].isspace():
+                    found.append(p)
+                if p + width < len(text) and not text[p+width].isspace():
+                    openers.append(p)
+                p = text.find(d, p + 1)
+        if not openers:
+            return text
+        openers.sort()
+
+        parts = []
+        pos = 0
+        for i in openers:
+            if i < pos:
+                continue
+            found = closers[text[i:i+width]]
+            j = bisect_left(found, i + width + 1)
+            if j == len(found):
+                continue
+            close = found[j]
+            if width == 2:
+                # `.+?[*_]*`: the lazy part stops where the run of `*`/`_`
+                # leading up to the first closer starts, then `[*_]*`
+                # takes that whole run and backs off to its last closer.
+                start = close
+                while start > i + width + 1 and text[start-1] in "*_":
+                    start -= 1
+                end = self._emphasis_run_re.match(text, start).end()
+                close = found[bisect_right(found, end) - 1]
+            parts.append(text[pos:i])
+            parts.append("<%s>%s</%s>" % (tag, text[i+width:close], tag))
+            pos = close + width
+        parts.append(text[pos:])
+        return ''.join(parts)
+
     # "smarty-pants" extra: Very liberal in interpreting a single prime as an
     # apostrophe; e.g. ignores the fact that "round", "bout", "twer", and
     # "twixt" can be written without an initial apostrophe. This is fine because
@@ -1802,8 +2078,10 @@ class Markdown(object):
     _bq_one_level_re = re.compile('^[ \t]*>[ \t]?', re.M);
 
     _html_pre_block_re = re.compile(r'(\s*<pre>.+?</pre>)', re.S)
+    _two_space_indent_re = re.compile(r'(?m)^  ')
+    _line_start_re = re.compile('(?m)^')
     def _dedent_two_spaces_sub(self, match):
-        return re.sub(r'(?m)^  ', '', match.group(1))
+        return self._two_space_indent_re.sub('', match.group(1))
 
     def _block_quote_sub(self, match):
         bq = match.group(1)
@@ -1811,7 +2089,7 @@ class Markdown(object):
         bq = self._ws_only_line_re.sub('', bq)  # trim whitespace-only lines
         bq = self._run_block_gamut(bq)          # recurse
 
-        bq = re.sub('(?m)^', '  ', bq)
+        bq = self._line_start_re.sub('  ', bq)
         # These leading spaces screw with <pre> content, so we need to fix that:
         bq = self._html_pre_block_re.sub(self._dedent_two_spaces_sub, bq)
 
@@ -1822,13 +2100,15 @@ class Markdown(object):
             return text
         return self._block_quote_re.sub(self._block_quote_sub, text)
 
+    _paragraph_split_re = re.compile(r"\n{2,}")
+
     def _form_paragraphs(self, text):
         # Strip leading and trailing lines:
         text = text.strip('\n')
 
         # Wrap <p> tags.
         grafs = []
-        for i, graf in enumerate(re.split(r"\n{2,}", text)):
+        for i, graf in enumerate(self._paragraph_split_re.split(text)):
             if graf in self.html_blocks:
                 # Unhashify HTML blocks
                 grafs.append(self.html_blocks[graf])
@@ -1860,6 +2140,13 @@ class Markdown(object):
         return "\n\n".join(grafs)
 
     def _add_footnotes(self, text):
+        footer = self._footnotes_html()
+        if footer:
+            return text + '\n\n' + footer
+        else:
+            return text
+
+    def _footnotes_html(self):
         if self.footnotes:
             footer = [
                 '<div class="footnotes">',
@@ -1883,9 +2170,8 @@ class Markdown(object):
                 footer.append('</li>')
             footer.append('</ol>')
             footer.append('</div>')
-            return text + '\n\n' + '\n'.join(footer)
-        else:
-            return text
+            return '\n'.join(footer)
+        return None
 
     # Ampersand-encoding based entirely on Nat Irons's Amputator MT plugin:
     #   http://bumppo.net/projects/amputator/
@@ -1917,6 +2203,31 @@ class Markdown(object):
         g1 = match.group(1)
         return '<a href="%s">%s</a>' % (g1, g1)
 
+    _auto_link_start_re = re.compile(r'<(https?|ftp):', re.I)
+    _auto_link_stop_re = re.compile(r'[\'">\s]')
+
+    def _sub_auto_links(self, text):
+        # `self._auto_link_re.sub(self._auto_link_sub, text)` without its
+        # quadratic worst case ("<http://" * n): an opener whose URL runs
+        # into anything but ">" fails, and so does every opener before
+        # that point, so the search resumes after it.
+        parts = []
+        pos = stop = 0
+        for m in self._auto_link_start_re.finditer(text):
+            start = m.start()
+            if start < pos or start < stop:
+                continue
+            s = self._auto_link_stop_re.search(text, m.end())
+            if s is None:
+                break
+            stop = s.start()
+            if text[stop] == '>' and stop > m.end():
+                parts.append(text[pos:start])
+                parts.append(self._auto_link_sub(self._auto_link_re.match(text, start)))
+                pos = stop + 1
+        parts.append(text[pos:])
+        return ''.join(parts)
+
     _auto_email_link_re = re.compile(r"""
           <
            (?:mailto:)?
@@ -1932,7 +2243,7 @@ class Markdown(object):
             self._unescape_special_chars(match.group(1)))
 
     def _do_auto_links(self, text):
-        text = self._auto_link_re.sub(self._auto_link_sub, text)
+        text = self._sub_auto_links(text)
         text = self._auto_email_link_re.sub(self._auto_email_link_sub, text)
         return text
 
@@ -2013,6 +2324,88 @@ class MarkdownWithExtras(Markdown):
     extras = ["footnotes", "code-color"]
 
 
+class IncrementalMarkdown(Markdown):
+    r"""A markdowner class that remembers the HTML of every top-level
+    block, so converting an edited document only converts the blocks
+    that changed.
+
+    Each conversion still runs the whole-document first pass (HTML block
+    hashing, link definitions). Blocks are then looked up by the hash of
+    their first-pass text; the cache is only valid for one set of link
+    definitions, so when those change it is dropped and the whole
+    document is converted again. Documents with footnotes, and the
+    "header-ids" and "toc" extras, number things across blocks and are
+    always converted in full. `last_stats` tells what the last
+    conversion did.
+
+    Like `Markdown`, an instance must not be used by two threads at once.
+
+        >>> m = IncrementalMarkdown()
+        >>> m.convert("one\n\ntwo\n")
+        '<p>one</p>\n\n<p>two</p>\n'
+        >>> m.convert("one\n\nthree\n")
+        '<p>one</p>\n\n<p>three</p>\n'
+        >>> sorted(m.last_stats.items())
+        [('blocks', 2), ('converted', 1), ('full', False)]
+    """
+    max_blocks = 4096
+
+    def __init__(self, max_blocks=None, **kwargs):
+        Markdown.__init__(self, **kwargs)
+        if max_blocks is not None:
+            self.max_blocks = max_blocks
+        self._block_cache = OrderedDict()  # block hash -> html, oldest first
+        self._block_context = None
+        self.last_stats = None
+
+    def _link_context(self):
+        return md5(repr((sorted(self.urls.items()),
+                         sorted(self.titles.items()))).encode('utf-8')).digest()
+
+    def convert(self, text):
+        """Convert the given text, reusing the HTML of unchanged blocks."""
+        text = self._convert_prelude(text)
+
+        use_cache = not ("header-ids" in self.extras
+                         or ("footnotes" in self.extras and self.footnotes))
+        context = self._link_context()
+        if context != self._block_context:
+            self._block_cache.clear()
+            self._block_context = context
+
+        cache = self._block_cache
+        fragments = []
+        converted = 0
+        for block in self._iter_top_level_blocks(text):
+            key = md5(block.encode('utf-8')).digest()
+            if use_cache and key in cache:
+                html = cache[key] = cache.pop(key)
+            else:
+                html = self._convert_finish(self._run_block_gamut(block))
+                converted += 1
+                if use_cache:
+                    cache[key] = html
+                    while len(cache) > self.max_blocks:
+                        cache.popitem(last=False)
+            fragments.append(html)
+        text = "\n\n".join(fragments)
+
+        if "footnotes" in self.extras:
+            footer = self._footnotes_html()
+            if footer:
+                text += self._convert_finish("\n\n" + footer)
+
+        text += "\n"
+        self.last_stats = dict(blocks=len(fragments), converted=converted,
+                               full=converted == len(fragments))
+
+        rv = UnicodeWithAttrs(text)
+        if "toc" in self.extras:
+            rv._toc = self._toc
+        if "metadata" in self.extras:
+            rv.metadata = self.metadata
+        return rv
+
 #---- internal support functions
 
 class UnicodeWithAttrs(unicode):
@@ -2208,10 +2601,12 @@ class _memoized(object):
    def __init__(self, func):
       self.func = func
       self.cache = {}
+      self.misses = 0
    def __call__(self, *args):
       try:
          return self.cache[args]
       except KeyError:
+         self.misses += 1
          self.cache[args] = value = self.func(*args)
          return value
       except TypeError:
@@ -2223,6 +2618,36 @@ class _memoized(object):
       return self.func.__doc__
 
 
+#---- regex registry
+#
+# Patterns that don't depend on options are compiled once at import as
+# class or module attributes. Patterns that depend on `tab_width` (or a
+# list marker, etc.) come from the `_regex_factory` functions below,
+# which compile once per argument combination on first use and are
+# counted, so `regex_compile_report()` can confirm that a steady-state
+# `convert()` compiles nothing.
+
+_regex_factories = []
+
+def _regex_factory(func):
+    """Memoize a function returning a compiled regex and register it."""
+    memoized = _memoized(func)
+    _regex_factories.append(memoized)
+    return memoized
+
+def regex_compile_report():
+    r"""Return a dict mapping each regex factory name to the number of
+    patterns it has compiled so far in this process.
+
+        >>> html = markdown("* a\n* b\n\n    code\n")
+        >>> before = regex_compile_report()
+        >>> html = markdown("* c\n* d\n\n    more code\n")
+        >>> regex_compile_report() == before
+        True
+    """
+    return dict((f.func.__name__, f.misses) for f in _regex_factories)
+
+
 def _xml_oneliner_re_from_tab_width(tab_width):
     """Standalone XML processing instruction regex."""
     return re.compile(r"""
@@ -2242,7 +2667,7 @@ def _xml_oneliner_re_from_tab_width(tab_width):
             (?=\n{2,}|\Z)       # followed by a blank line or end of document
         )
         """ % (tab_width - 1), re.X)
-_xml_oneliner_re_from_tab_width = _memoized(_xml_oneliner_re_from_tab_width)
+_xml_oneliner_re_from_tab_width = _regex_factory(_xml_oneliner_re_from_tab_width)
 
 def _hr_tag_re_from_tab_width(tab_width):
      return re.compile(r"""
@@ -2261,7 +2686,142 @@ def _hr_tag_re_from_tab_width(tab_width):
             (?=\n{2,}|\Z)       # followed by a blank line or end of document
         )
         """ % (tab_width - 1), re.X)
-_hr_tag_re_from_tab_width = _memoized(_hr_tag_re_from_tab_width)
+_hr_tag_re_from_tab_width = _regex_factory(_hr_tag_re_from_tab_width)
+
+def _outdent_re_from_tab_width(tab_width):
+    return re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+_outdent_re_from_tab_width = _regex_factory(_outdent_re_from_tab_width)
+
+def _link_def_re_from_tab_width(tab_width):
+    return re.compile(r"""
+        ^[ ]{0,%d}\[(.+)\]: # id = \1
+          [ \t]*
+          \n?               # maybe *one* newline
+          [ \t]*
+        <?(.+?)>?           # url = \2
+          [ \t]*
+        (?:
+            \n?             # maybe one newline
+            [ \t]*
+            (?<=\s)         # lookbehind for whitespace
+            ['"(]
+            ([^\n]*)        # title = \3
+            ['")]
+            [ \t]*
+        )?  # title is optional
+        (?:\n+|\Z)
+        """ % (tab_width - 1), re.X | re.M | re.U)
+_link_def_re_from_tab_width = _regex_factory(_link_def_re_from_tab_width)
+
+def _footnote_def_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
+        [ \t]*
+        (                       # footnote text = \2
+          # First line need not start with the spaces.
+          (?:\s*.*\n+)
+          (?:
+            (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
+            .*\n+
+          )*
+        )
+        # Lookahead for non-space at line-start, or end of doc.
+        (?:(?=^[ ]{0,%d}\S)|\Z)
+        ''' % (tab_width - 1, tab_width, tab_width),
+        re.X | re.M)
+_footnote_def_re_from_tab_width = _regex_factory(_footnote_def_re_from_tab_width)
+
+def _pyshell_block_re_from_tab_width(tab_width):
+    return re.compile(r"""
+        ^([ ]{0,%d})>>>[ ].*\n   # first line
+        ^(\1.*\S+.*\n)*         # any number of subsequent lines
+        ^\n                     # ends with a blank line
+        """ % (tab_width - 1), re.M | re.X)
+_pyshell_block_re_from_tab_width = _regex_factory(_pyshell_block_re_from_tab_width)
+
+def _table_re_from_tab_width(tab_width):
+    return re.compile(r'''
+            (?:(?<=\n\n)|\A\n?)             # leading blank line
+
+            ^[ ]{0,%d}                      # allowed whitespace
+            ((?=.*[|]).*)  \n              # $1: header row (at least one pipe)
+
+            ^[ ]{0,%d}                      # allowed whitespace
+            (                               # $2: underline row
+                # underline row with leading bar
+                (?:  \|\ *:?-+:?\ *  )+  \|?  \n
+                |
+                # or, underline row without leading bar
+                (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
+            )
+
+            (                               # $3: data rows
+                (?:
+                    ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
+                    (?=.*\|).*  \n         # (a lookahead: `.*\|.*` backtracks
+                )+                          #  over every pipe when no row follows)
+            )
+        ''' % (tab_width - 1, tab_width - 1, tab_width - 1), re.M | re.X)
+_table_re_from_tab_width = _regex_factory(_table_re_from_tab_width)
+
+def _wiki_table_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        (?:(?<=\n\n)|\A\n?)            # leading blank line
+        ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
+        (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
+        ''' % (tab_width - 1), re.M | re.X)
+_wiki_table_re_from_tab_width = _regex_factory(_wiki_table_re_from_tab_width)
+
+def _code_block_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        (?:\n\n|\A\n?)
+        (               # $1 = the code block -- one or more lines, starting with a space/tab
+          (?:
+            (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
+            .*\n+
+          )+
+        )
+        ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
+        # Lookahead to make sure this block isn't already in a code block.
+        # Needed when syntax highlighting is being used.
+        (?![^<]*\</code\>)
+        ''' % (tab_width, tab_width),
+        re.M | re.X)
+_code_block_re_from_tab_width = _regex_factory(_code_block_re_from_tab_width)
+
+def _list_re_from_tab_width(tab_width, marker_pat, sub_list):
+    whole_list = r'''
+        (                   # \1 = whole list
+          (                 # \2
+            [ ]{0,%d}
+            (%s)            # \3 = first list item marker
+            [ \t]+
+            (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
+          )
+          (?:.+?)
+          (                 # \4
+              \Z
+            |
+              \n{2,}
+              (?=\S)
+              (?!           # Negative lookahead for another list item marker
+                [ \t]*
+                %s[ \t]+
+              )
+          )
+        )
+    ''' % (tab_width - 1, marker_pat, marker_pat)
+    if sub_list:
+        return re.compile("^"+whole_list, re.X | re.M | re.S)
+    else:
+        return re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
+                          re.X | re.M | re.S)
+_list_re_from_tab_width = _regex_factory(_list_re_from_tab_width)
+
+def _balanced_chars_re(open_c, close_c):
+    """The open_c and close_c characters, for `Markdown._find_balanced()`."""
+    return re.compile("[%s%s]" % (re.escape(open_c), re.escape(close_c)))
+_balanced_chars_re = _regex_factory(_balanced_chars_re)
 
 
 def _xml_escape_attr(attr, skip_single_quote=True):
@@ -1,5 +1,6 @@
 import time, uuid
 
+import session
 from orm import Model, IntegerField, StringField, BooleanField, FloatField, TextField
 
 #根据当前时间和uuid生成主键
@@ -8,6 +9,9 @@ def next_id():
 
 class User(Model):
     __table__ = 'users'
+    __views__ = {
+        'public': ('email', 'admin', 'name', 'image', 'created_at'),     #不查密码
+    }
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(ddl='varchar(50)')      #邮箱代表用户账号 在数据库表中创建了unique key
@@ -17,8 +21,37 @@ class User(Model):
     image = StringField(ddl='varchar(500)')
     created_at = FloatField(default=time.time)  #时间也用key创建了索引 方便按时间查找
 
+    #改了密码/管理员权限或者删掉的用户 session里缓存的登录状态要作废 下次请求重新验证cookie
+    #现在没有修改用户的handler 写在这里以后加的handler和脚本也不会漏掉
+    async def update(self):
+        await super().update()
+        session.invalidate_user(self.id)
+
+    async def remove(self):
+        await super().remove()
+        session.invalidate_user(self.id)
+
+    @classmethod
+    async def updateAll(cls, instances, batchSize=None):
+        instances = list(instances)
+        affected = await super().updateAll(instances, batchSize)
+        for user in instances:
+            session.invalidate_user(user.id)
+        return affected
+
+    @classmethod
+    async def removeAll(cls, pks, batchSize=None):
+        pks = list(pks)
+        affected = await super().removeAll(pks, batchSize)
+        for uid in pks:
+            session.invalidate_user(uid)
+        return affected
+
 class Blog(Model):
     __table__ = 'blogs'
+    __views__ = {
+        'summary': ('user_id', 'user_name', 'user_image', 'name', 'summary', 'created_at'),  #列表页用 不查正文
+    }
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     user_id = StringField(ddl='varchar(50)')
@@ -27,6 +60,8 @@ class Blog(Model):
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
     content = TextField()
+    html_content = TextField(ddl='mediumtext')  #保存时就渲染好的html 读的时候直接用 长文章的html会超过text的64KB
+    render_version = StringField(ddl='varchar(50)')     #渲染html_content时的markdown2版本和选项 不一致就需要重新渲染
     created_at = FloatField(default=time.time)
 
 class Comment(Model):
@@ -1,10 +1,47 @@
-import asyncio, aiomysql, logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')  # 设置日志级别
+import asyncio, aiomysql, contextlib, contextvars, logging, time
+
+from cache import LRUCache
+
+#映射和批量写入的日志记到orm 每条sql的日志记到orm.sql 生产环境可以单独关掉或者采样
+_log = logging.getLogger('orm')
+_sql_log = logging.getLogger('orm.sql')
+
+#sql语句缓存 Model的查询按where/orderBy/limit的形式拼接语句 热门查询翻来覆去就那么几条
+#key是Model拼语句用的参数 value是拼好并且已经把?换成%s的语句
+#aiomysql只支持文本协议 没有服务端的预编译语句 参数还是在客户端转义后拼进去
+SQL_CACHE_SIZE = 512
+_sql_cache = LRUCache(max_entries=SQL_CACHE_SIZE)
+
+#从缓存取语句 没有就用build()生成 换好占位符再缓存
+def _statement(key, build):
+    sql = _sql_cache.get(key)
+    if sql is None:
+        sql = _prepare(build())
+        _sql_cache.put(key, sql)
+    return sql
+
+#?占位符换成aiomysql用的%s Model的语句在拼的时候就换好了 执行时传prepared=True
+#只有手写的sql每次执行时换
+def _prepare(sql):
+    return sql.replace('?', '%s')
+
+def sql_cache_stats():
+    return _sql_cache.stats()
+
+#saveAll/updateAll/removeAll每条语句最多写多少行 太大了会超过mysql的max_allowed_packet
+_batch_size = 500
+
+#Model.countCached()的缓存多少秒后重新查一次数据库 修正别的进程写入造成的偏差
+_count_ttl = 60
+#每个Model最多缓存多少种where条件的数量
+COUNT_CACHE_SIZE = 64
 
 #创建数据库连接池
 async def create_pool(loop, **kw):
-    logging.info('创建数据库连接池...')
-    global __pool
+    _log.info('创建数据库连接池...')
+    global __pool, _count_ttl, _batch_size
+    _count_ttl = kw.get('count_ttl', _count_ttl)
+    _batch_size = kw.get('batch_size', _batch_size)
     __pool = await aiomysql.create_pool(
         host = kw.get('host', 'localhost'),
         port = kw.get('port', 3306),
@@ -18,39 +55,122 @@ async def create_pool(loop, **kw):
         loop=loop
     )
 
-#select
-async def select(sql, args, size=None):
-    logging.info('查询sql: %s' % sql)
+#connection()/transaction()里固定使用的连接 和事务提交后要执行的回调
+#contextvar跟着协程走 同一个请求里的select/execute/Model方法自动用同一个连接
+#注意作用域里不要用asyncio.gather并发查询 一个连接同一时间只能执行一条语句
+_connection = contextvars.ContextVar('orm_connection', default=None)
+_after_commit = contextvars.ContextVar('orm_after_commit', default=None)
+
+#在作用域里固定用一个连接 处理一个请求要查好几次的时候 不用每次都从连接池取还
+@contextlib.asynccontextmanager
+async def connection():
+    conn = _connection.get()
+    if conn is not None:
+        yield conn
+        return
     global __pool
-    async with __pool.get() as conn: #从连接池获取一个数据库连接 这里写with await __pool.get()也可以
+    async with __pool.get() as conn:
+        token = _connection.set(conn)
+        try:
+            yield conn
+        finally:
+            _connection.reset(token)
+
+#async with orm.transaction(): 作用域里所有的语句在同一个事务里 正常退出就提交 抛异常就回滚
+#嵌套的transaction()合并到最外层的事务里
+@contextlib.asynccontextmanager
+async def transaction():
+    if _after_commit.get() is not None:
+        yield _connection.get()
+        return
+    async with connection() as conn:
+        callbacks = []
+        token = _after_commit.set(callbacks)
+        try:
+            await conn.begin()
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException as e:
+                await conn.rollback()
+                raise
+        finally:
+            _after_commit.reset(token)
+        for fn in callbacks:
+            fn()
+
+#事务提交以后再执行fn 事务回滚了就不执行 不在事务里就马上执行
+def after_commit(fn):
+    callbacks = _after_commit.get()
+    if callbacks is None:
+        fn()
+    else:
+        callbacks.append(fn)
+
+#一个请求内的identity map (表名, 主键) => Model实例 同一个请求里重复find同一行 直接返回已经查出来的实例
+#由app.py里的中间件用 with orm.identity_map(): 包住整个请求 不在作用域里就和以前一样每次都查
+_identity = contextvars.ContextVar('orm_identity_map', default=None)
+_identity_stats = dict(hits=0, misses=0)    #hits就是省掉的查询次数
+
+@contextlib.contextmanager
+def identity_map():
+    token = _identity.set({})
+    try:
+        yield
+    finally:
+        _identity.reset(token)
+
+def identity_map_stats():
+    return dict(_identity_stats)
+
+#select
+#prepared=True表示sql已经是%s占位符
+async def select(sql, args, size=None, prepared=False):
+    _sql_log.info('查询sql: %s', sql)
+    async with connection() as conn: #从连接池获取一个数据库连接 在connection()/transaction()里就用固定的那个
         async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(sql.replace('?', '%s'), args or ())
+            await cur.execute(sql if prepared else _prepare(sql), args or ())
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
-        logging.info('返回行数：%s' % len(rs))
+        _sql_log.info('返回行数：%s', len(rs))
         return rs
 
 #insert delete update通用
-async def execute(sql, args, autocommit=True):
-    logging.info('sql: %s' % sql)
-    global __pool
-    async with __pool.get() as conn:
-        if not autocommit:
-            await conn.begin()
-        try:
-            async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?', '%s'), args or ()) #如果sql执行失败 就回滚
-                affected = cur.rowcount
-                if not autocommit:
-                    conn.commit()
-        except BaseException as e:
-            if not autocommit:
-                await conn.rollback()
-            raise
+#autocommit=False就单独开一个事务执行 已经在transaction()里就直接加入外面的事务
+async def execute(sql, args, autocommit=True, prepared=False):
+    _sql_log.info('sql: %s', sql)
+    if not autocommit and _after_commit.get() is None:
+        async with transaction():   #如果sql执行失败 就回滚
+            return await execute(sql, args, prepared=prepared)
+    async with connection() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute(sql if prepared else _prepare(sql), args or ())
+            return cur.rowcount
+
+#批量写入 在同一个连接的同一个事务里执行一组(sql, args) 有一条失败就全部回滚
+#many=True时每一组的args是多行参数 用executemany执行 返回每一组的受影响行数
+async def execute_batch(statements, many=False, prepared=False):
+    async with transaction() as conn:
+        affected = []
+        async with conn.cursor() as cur:
+            for sql, args in statements:
+                _sql_log.info('批量sql(第%s批): %s', len(affected) + 1, sql)
+                if not prepared:
+                    sql = _prepare(sql)
+                if many:
+                    await cur.executemany(sql, args)
+                else:
+                    await cur.execute(sql, args)
+                affected.append(cur.rowcount)
         return affected
 
+#把序列按size切成小块
+def chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 #orm框架
 class Field(object):
     def __init__(self, name, column_type, primary_key, default):
@@ -79,8 +199,8 @@ class FloatField(Field):
         super().__init__(name, 'real', primary_key, default)
 
 class TextField(Field):
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default) #varchar可以设置最大长度，text不设置长度
+    def __init__(self, name=None, default=None, ddl='text'):   #text最多64KB 更长的内容用mediumtext
+        super().__init__(name, ddl, False, default) #varchar可以设置最大长度，text不设置长度
 
 #创建带参数的sql语句中的参数
 def create_args_string(num):
@@ -88,6 +208,23 @@ def create_args_string(num):
     for n in range(num):
         L.append('?')
     return ', '.join(L)
+#keyset分页的条件和参数 keys是排序的列 op是<或> 比如(a, b)往后翻: (a<?) or (a=? and b<?)
+def create_seek_where(keys, op):
+    conds = []
+    for i in range(len(keys)):
+        conds.append(' and '.join(['`%s`=?' % k for k in keys[:i]] + ['`%s`%s?' % (keys[i], op)]))
+    return '(%s)' % ' or '.join('(%s)' % c for c in conds)
+
+def create_seek_args(values):
+    args = []
+    for i in range(len(values)):
+        args.extend(values[:i + 1])
+    return args
+
+#访问了查询时没有选出来的字段
+class FieldNotLoadedError(AttributeError):
+    pass
+
 #具体做映射的元类
 class ModelMetaclass(type):
     def __new__(cls, name, bases, attrs):
@@ -95,14 +232,14 @@ class ModelMetaclass(type):
             return type.__new__(cls, name, bases, attrs)
         #获取表名
         tableName = attrs.get('__table__', None) or name #继承了Model的类 如果有__table__就作为表名 没有就用类名做表名
-        logging.info('建立映射：%s(table: %s)' % (name, tableName))
+        _log.info('建立映射：%s(table: %s)', name, tableName)
         #获取所有列和主键
         mappings = dict()
         fields = []
         primaryKey = None
         for k, v in attrs.items():
             if isinstance(v, Field):
-                logging.info('建立映射：%s==>%s' % (k, v))
+                _log.info('建立映射：%s==>%s', k, v)
                 mappings[k] = v
                 if v.primary_key:
                     if primaryKey:
@@ -119,12 +256,26 @@ class ModelMetaclass(type):
         attrs['__table__'] = tableName
         attrs['__primary_key__'] = primaryKey #主键属性名
         attrs['__fields__'] = fields #除主键外的属性名
-        #构建crud参数的语句
+        #构建crud参数的语句 ?在这里一次换成%s 执行时不用再换
         escaped_fields = list(map(lambda f: '`%s`' % f, fields)) #``用来保证和mysql中的关键字不冲突
         attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ','.join(escaped_fields), tableName) #select * from tableName
-        attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ','.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1)) #insert into tableName (*) values (?,?,?...)
-        attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey) #update tableName set f1=?, f2=?... where primaryKey =?
-        attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey) #delete from tableName where primaryKey =?
+        attrs['__insert__'] = _prepare('insert into `%s` (%s, `%s`) values (%s)' % (tableName, ','.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))) #insert into tableName (*) values (?,?,?...)
+        attrs['__update__'] = _prepare('update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)) #update tableName set f1=?, f2=?... where primaryKey =?
+        attrs['__delete__'] = _prepare('delete from `%s` where `%s`=?' % (tableName, primaryKey)) #delete from tableName where primaryKey =?
+        attrs['__find__'] = _prepare('%s where `%s`=?' % (attrs['__select__'], primaryKey)) #select * from tableName where primaryKey = ?
+        attrs['__counts__'] = {} #countCached的缓存 (where, args) => [数量, 查询时间]
+        #keyset分页的排序列 按这几列倒序 最后一列必须唯一 默认是(created_at, 主键)
+        keyset = attrs.get('__keyset__', None)
+        if keyset is None and 'created_at' in mappings:
+            keyset = ('created_at', primaryKey)
+        attrs['__keyset__'] = tuple(keyset or (primaryKey,))
+        #命名的字段子集 比如列表页不需要正文 find/findAll(view='summary')只查这几列 主键总会查出来
+        views = attrs.get('__views__', None) or {}
+        for view, names in views.items():
+            for f in names:
+                if f not in mappings:
+                    raise RuntimeError('视图%s中的字段%s不存在' % (view, f))
+        attrs['__views__'] = dict((view, tuple(names)) for view, names in views.items())
 
         return type.__new__(cls, name, bases, attrs)
 
@@ -137,6 +288,8 @@ class Model(dict, metaclass=ModelMetaclass):
         try:
             return self[key]
         except KeyError:
+            if key in self.__dict__.get('__unloaded__', ()):
+                raise FieldNotLoadedError(r"'%s'的字段'%s'没有查询出来 先调用load()" % (self.__class__.__name__, key))
             raise AttributeError(r"'Model'没有属性 '%s'" % key)
 
     def __setattr__(self, key, value):
@@ -151,70 +304,262 @@ class Model(dict, metaclass=ModelMetaclass):
             field = self.__mappings__[key]
             if field.default is not None:
                 value = field.default() if callable(field.default) else field.default #默认值可以是值，也可以是函数，比如日期，id等的计算函数
-                logging.debug('使用默认值 %s: %s' % (key, str(value)))
+                _log.debug('使用默认值 %s: %s', key, value)
                 setattr(self, key, value)
         return value
 
+    #fields/view对应的查询字段 None表示全部字段
+    @classmethod
+    def _projection(cls, fields=None, view=None):
+        if view is not None:
+            if view not in cls.__views__:
+                raise ValueError('Invalid view: %s' % view)
+            fields = cls.__views__[view]
+        if fields is None:
+            return None
+        fields = tuple(f for f in cls.__fields__ if f in fields)
+        if len(fields) == len(cls.__fields__):
+            return None
+        return fields
+
+    #只查fields这几列的select语句
     @classmethod
-    async def find(cls, pk):    #查询方法与具体实例无关，设置为类方法 所以self也就换成了cls
-        rs = await select('%s where `%s`=?' % (cls.__select__, cls.__primary_key__), [pk], 1)   #select * from tableName where primaryKey = ?
+    def _select(cls, fields):
+        if fields is None:
+            return cls.__select__
+        return _statement((cls.__table__, 'select', fields), lambda: 'select %s from `%s`' % (', '.join('`%s`' % f for f in (cls.__primary_key__,) + fields), cls.__table__))
+
+    #用查询结果创建实例 只查了部分字段的 记下没有查的字段 访问时抛FieldNotLoadedError
+    @classmethod
+    def _fromRow(cls, row, fields=None):
+        obj = cls(**row)
+        if fields is not None:
+            object.__setattr__(obj, '__unloaded__', frozenset(f for f in cls.__fields__ if f not in fields))
+        return obj
+
+    @classmethod
+    async def find(cls, pk, fields=None, view=None):    #查询方法与具体实例无关，设置为类方法 所以self也就换成了cls
+        fields = cls._projection(fields, view)
+        identity = _identity.get()
+        if identity is not None:
+            obj = identity.get((cls.__table__, pk))   #identity map里只放查了全部字段的实例 部分字段的查询也能用
+            if obj is not None:
+                _identity_stats['hits'] += 1
+                return obj
+            _identity_stats['misses'] += 1
+        if fields is None:
+            sql = cls.__find__
+        else:
+            sql = _statement((cls.__table__, 'find', fields), lambda: '%s where `%s`=?' % (cls._select(fields), cls.__primary_key__))
+        rs = await select(sql, [pk], 1, prepared=True)
         if len(rs) == 0:
             return None
-        return cls(**rs[0]) #查询到的数据是dict的list 使用关键字参数传入第一个dict 然后创建一个Model子类实例
+        obj = cls._fromRow(rs[0], fields) #查询到的数据是dict的list 使用关键字参数传入第一个dict 然后创建一个Model子类实例
+        if fields is None:
+            obj._remember()
+        return obj
+
+    #放进当前请求的identity map
+    def _remember(self):
+        identity = _identity.get()
+        if identity is not None:
+            identity[(self.__table__, self.getValue(self.__primary_key__))] = self
+
+    @classmethod
+    def _forget(cls, pks):
+        identity = _identity.get()
+        if identity is not None:
+            for pk in pks:
+                identity.pop((cls.__table__, pk), None)
 
+    #把查询时没有选出来的字段补上
+    async def load(self):
+        unloaded = [f for f in self.__fields__ if f in self.__dict__.get('__unloaded__', ()) and f not in self]
+        if unloaded:
+            rs = await select(self._select(tuple(unloaded)) + ' where `%s`=%%s' % self.__primary_key__, [self.getValue(self.__primary_key__)], 1, prepared=True)
+            if len(rs) == 0:
+                return self
+            for f in unloaded:
+                self[f] = rs[0].get(f)
+        object.__setattr__(self, '__unloaded__', frozenset())
+        return self
+
+    #cursor=排序键 就是keyset分页: 按__keyset__倒序 取排在这条记录后面的数据 reverse=True取前面的数据
+    #结果都是倒序的 不用offset 翻到多深都只扫描limit行
+    #fields=[...]或view='名字' 只查部分字段 列表页不用把大字段也查出来
     @classmethod
     async def findAll(cls, where=None, args=None, **kw):
-        sql = [cls.__select__]
-        if where:
-            sql.append('where')
-            sql.append(where)
         if args is None:
             args = []
+        fields = cls._projection(kw.get('fields', None), kw.get('view', None))
         orderBy = kw.get('orderBy', None)
-        if orderBy:
-            sql.append('order by')
-            sql.append(orderBy)
+        cursor = kw.get('cursor', None)
+        reverse = kw.get('reverse', False)
+        if cursor is not None:
+            if orderBy:
+                raise ValueError('orderBy can not be used with cursor')
+            if len(cursor) != len(cls.__keyset__):
+                raise ValueError('Invalid cursor value: %s' % str(cursor))
+            seek = create_seek_where(cls.__keyset__, '>' if reverse else '<')
+            where = '(%s) and %s' % (where, seek) if where else seek
+            args.extend(create_seek_args(list(cursor)))
+            orderBy = ', '.join('`%s` %s' % (k, 'asc' if reverse else 'desc') for k in cls.__keyset__)
         limit = kw.get('limit', None)
+        limitArgs = None
         if limit is not None:
-            sql.append('limit')
             if isinstance(limit, int):
-                sql.append('?')
+                limitArgs = '?'
                 args.append(limit)
             elif isinstance(limit, tuple) and len(limit) == 2:
-                sql.append('?, ?')
+                limitArgs = '?, ?'
                 args.extend(limit)
             else:
                 raise ValueError('Invalid limit value: %s' % str(limit))
-        rs = await select(' '.join(sql), args)
-        return [cls(**r) for r in rs]
+        def build():
+            sql = [cls._select(fields)]
+            if where:
+                sql.append('where')
+                sql.append(where)
+            if orderBy:
+                sql.append('order by')
+                sql.append(orderBy)
+            if limitArgs:
+                sql.append('limit')
+                sql.append(limitArgs)
+            return ' '.join(sql)
+        #同样的where/orderBy/limit形式拼出来的语句都一样 只有参数不同
+        sql = _statement((cls.__table__, 'findAll', fields, where, orderBy, limitArgs), build)
+        rs = await select(sql, args, prepared=True)
+        if cursor is not None and reverse:
+            rs.reverse()
+        return [cls._fromRow(r, fields) for r in rs]
+
+    #keyset分页用的排序键
+    def cursorKey(self):
+        return tuple(self.getValue(k) for k in self.__keyset__)
 
     @classmethod
     async def findNumber(cls, selectField, where=None, args=None): #这个就是查询某一个字段
-        sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
-        if where:
-            sql.append('where')
-            sql.append(where)
-        rs = await select(' '.join(sql), args,1)
+        def build():
+            sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+            if where:
+                sql.append('where')
+                sql.append(where)
+            return ' '.join(sql)
+        sql = _statement((cls.__table__, 'findNumber', selectField, where), build)
+        rs = await select(sql, args, 1, prepared=True)
         if len(rs) == 0:
             return None
         return rs[0]['_num_']  #查询到的数据是dict的list 加上[0]和[__num__]用于查询总数
 
+    #带缓存的count 分页每次都要查总数 表大了count(id)就是全索引扫描
+    #不带where的总数在save/remove时直接加减 带where的数量没法判断写入的行符不符合条件 写入时整个丢掉
+    #超过_count_ttl秒重新查一次数据库
+    @classmethod
+    async def countCached(cls, where=None, args=None):
+        key = (where, tuple(args or ()))
+        item = cls.__counts__.get(key)
+        if item is not None and time.time() - item[1] < _count_ttl:
+            return item[0]
+        num = await cls.findNumber('count(`%s`)' % cls.__primary_key__, where, args)
+        if len(cls.__counts__) >= COUNT_CACHE_SIZE:
+            cls._countChanged(0)
+        cls.__counts__[key] = [num, time.time()]
+        return num
+
+    #写入成功后维护countCached的缓存 delta是总行数的变化 在事务里的话等提交了再算
+    @classmethod
+    def _countChanged(cls, delta):
+        def apply():
+            total = cls.__counts__.get((None, ()))
+            cls.__counts__.clear()
+            if total is not None:
+                total[0] += delta
+                cls.__counts__[(None, ())] = total
+        after_commit(apply)
+
     async def save(self):
+        unloaded = [f for f in self.__fields__ if f in self.__dict__.get('__unloaded__', ()) and f not in self]
+        if unloaded:
+            raise ValueError('不能插入只查询了部分字段的%s 缺少: %s' % (self.__class__.__name__, ', '.join(unloaded)))
         args = list(map(self.getValueOrDefault, self.__fields__))
         args.append(self.getValueOrDefault(self.__primary_key__))
-        rows = await execute(self.__insert__, args)
+        rows = await execute(self.__insert__, args, prepared=True)
         if rows != 1:
-            logging.warning('插入失败: 受影响行数: %s' % rows)
+            _log.warning('插入失败: 受影响行数: %s', rows)
+        else:
+            self._countChanged(1)
+            after_commit(self._remember)    #事务回滚了这一行就不存在 不能放进identity map
+
+    #批量插入 每batchSize行拼成一条insert ... values (...),(...) 全部在一个事务里 返回每一批插入的行数
+    @classmethod
+    async def saveAll(cls, instances, batchSize=None):
+        rows = []
+        for obj in instances:
+            if obj.__dict__.get('__unloaded__'):
+                raise ValueError('不能插入只查询了部分字段的%s' % cls.__name__)
+            rows.append(list(map(obj.getValueOrDefault, cls.__fields__)) + [obj.getValueOrDefault(cls.__primary_key__)])
+        if not rows:
+            return []
+        values = '(%s)' % create_args_string(len(cls.__fields__) + 1)
+        def statement(chunk):
+            n = len(chunk)
+            sql = _statement((cls.__table__, 'saveAll', n), lambda: cls.__insert__[:cls.__insert__.rindex('values')] + 'values ' + ', '.join([values] * n))
+            return sql, [arg for row in chunk for arg in row]
+        affected = await execute_batch([statement(c) for c in chunks(rows, batchSize or _batch_size)], prepared=True)
+        _log.info('批量插入%s: %s', cls.__table__, affected)
+        cls._countChanged(sum(affected))
+        return affected
+
+    #批量更新 一批用一次executemany执行 返回每一批更新的行数
+    @classmethod
+    async def updateAll(cls, instances, batchSize=None):
+        rows = []
+        for obj in instances:
+            if obj.__dict__.get('__unloaded__'):
+                raise ValueError('只查询了部分字段的%s不能批量更新 先调用load()' % cls.__name__)
+            rows.append(list(map(obj.getValue, cls.__fields__)) + [obj.getValue(cls.__primary_key__)])
+        if not rows:
+            return []
+        affected = await execute_batch([(cls.__update__, c) for c in chunks(rows, batchSize or _batch_size)], many=True, prepared=True)
+        _log.info('批量更新%s: %s', cls.__table__, affected)
+        cls._countChanged(0)
+        return affected
+
+    #按主键批量删除 每batchSize个主键一条delete ... where pk in (...) 返回每一批删除的行数
+    @classmethod
+    async def removeAll(cls, pks, batchSize=None):
+        pks = list(pks)
+        if not pks:
+            return []
+        def statement(chunk):
+            n = len(chunk)
+            sql = _statement((cls.__table__, 'removeAll', n), lambda: 'delete from `%s` where `%s` in (%s)' % (cls.__table__, cls.__primary_key__, create_args_string(n)))
+            return sql, chunk
+        affected = await execute_batch([statement(c) for c in chunks(pks, batchSize or _batch_size)], prepared=True)
+        _log.info('批量删除%s: %s', cls.__table__, affected)
+        cls._forget(pks)
+        cls._countChanged(-sum(affected))
+        return affected
 
     async def remove(self):
         args = [self.getValue(self.__primary_key__)]
-        rows = await execute(self.__delete__, args)
+        rows = await execute(self.__delete__, args, prepared=True)
+        self._forget(args)
         if rows != 1:
-            logging.warning('删除失败: 受影响行数: %s' % rows)
+            _log.warning('删除失败: 受影响行数: %s', rows)
+        else:
+            self._countChanged(-1)
 
     async def update(self):
-        args = list(map(self.getValue, self.__fields__))
+        sql, fields = self.__update__, self.__fields__
+        if self.__dict__.get('__unloaded__'):   #只更新查询出来的(或者后来赋值了的)字段
+            fields = tuple(f for f in self.__fields__ if f in self)
+            sql = _statement((self.__table__, 'update', fields), lambda: 'update `%s` set %s where `%s`=?' % (self.__table__, ', '.join(map(lambda f: '`%s`=?' % (self.__mappings__.get(f).name or f), fields)), self.__primary_key__))
+        args = list(map(self.getValue, fields))
         args.append(self.getValue(self.__primary_key__))
-        rows = await execute(self.__update__, args)
+        rows = await execute(sql, args, prepared=True)
         if rows != 1:
-            logging.warning('更新失败: 受影响行数: %s' % rows)
\ No newline at end of file
+            _log.warning('更新失败: 受影响行数: %s', rows)
+        else:
+            self._countChanged(0)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import hashlib, time
+
+from cache import LRUCache
+from config import configs
+
+#整页缓存 匿名用户看到的页面都一样 只有管理员发博客/改博客/有人评论时才会变
+#@get(path, cache=True)的页面 由app.py里的中间件按 路径 => {查询参数: 缓存项} 保存编码好的body和ETag
+#查询参数是coreweb.route_cache_query()的结果 只有处理函数声明了的参数 乱加的参数不会多出缓存项
+#写操作调用invalidate()去掉受影响的路径 每个worker进程各自一份 ttl兜底别的进程的修改和页面上的"x分钟前"
+
+#一个路径下所有查询参数的body总字节数
+def _entries_size(entries):
+    return sum(len(entry[0]) for entry in entries.values())
+
+_options = configs.pagecache
+_ttl = _options.ttl
+_max_variants = _options.max_variants
+_cache = LRUCache(max_entries=_options.max_entries, max_bytes=_options.max_bytes, sizeof=_entries_size)
+_stats = dict(hits=0, misses=0, not_modified=0)
+
+#每次失效加1 请求开始时记下版本 渲染期间有写操作的话 这个可能是旧数据的结果就不缓存
+_version = 0
+
+def version():
+    return _version
+
+def etag(body):
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+#返回(body, etag, content_type, 过期时间) 没有或者过期了返回None
+def get(path, query):
+    entries = _cache.get(path)
+    entry = entries.get(query) if entries is not None else None
+    if entry is None or entry[3] < time.time():
+        _stats['misses'] += 1
+        return None
+    _stats['hits'] += 1
+    return entry
+
+#version是请求开始时的version() 返回缓存项 版本变了就只返回不保存
+#直接改缓存里的dict 不复制 顺便去掉这个路径下过期的缓存项 查询参数太多时去掉最早放进去的
+#改完再put一次 让LRUCache重新算这个路径的字节数 整个dict太大放不下就只试着留这一项
+def put(path, query, body, content_type, version):
+    now = time.time()
+    entry = (body, etag(body), content_type, now + _ttl)
+    if version != _version:
+        return entry
+    entries = _cache.get(path)
+    if entries is None:
+        entries = {}
+    else:
+        for q in [q for q, e in entries.items() if e[3] < now]:
+            del entries[q]
+        entries.pop(query, None)
+        while len(entries) >= _max_variants:
+            del entries[next(iter(entries))]
+    entries[query] = entry
+    if not _cache.put(path, entries):   #放不下时缓存里还是改过的dict和旧的字节数 整个去掉
+        _cache.pop(path)
+        if len(entries) > 1:
+            _cache.put(path, {query: entry})
+    return entry
+
+#If-None-Match里有这个etag 浏览器的缓存还能用
+def not_modified(if_none_match, tag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*' or tag in [t.strip().replace('W/', '', 1) for t in if_none_match.split(',')]:
+        _stats['not_modified'] += 1
+        return True
+    return False
+
+#内容变了 去掉这些路径下所有查询参数的缓存
+def invalidate(*paths):
+    global _version
+    _version += 1
+    for path in paths:
+        _cache.pop(path)
+
+def clear():
+    global _version
+    _version += 1
+    _cache.clear()
+
+def stats():
+    return dict(_cache.stats(), **_stats)
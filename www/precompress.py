@@ -0,0 +1,46 @@
+#把static/下面的css/js/字体等文本文件预先用最高压缩级别压缩成同目录下的.gz(装了brotli还有.br) 部署时在启动app之前执行
+#运行时coreweb.add_static()按Accept-Encoding直接发压缩好的文件 不用每个请求都压缩
+#用法: python precompress.py          只压缩新增的和改过的文件
+#      python precompress.py --force  全部重新压缩
+import os, sys
+
+import compress
+
+#这些后缀的文件值得压缩 woff/woff2/图片本来就是压缩过的
+EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.otf', '.ttf', '.eot')
+
+def precompress_file(filename, force=False):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    written = []
+    for encoding in compress.ENCODINGS:
+        target = filename + compress.PRECOMPRESSED_SUFFIX[encoding]
+        if not force and os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(filename):
+            continue
+        body = compress.compress(data, encoding, gzip_level=9, brotli_quality=11)
+        if len(body) >= len(data):  #压缩了反而更大 不生成 之前生成的也删掉
+            if os.path.isfile(target):
+                os.remove(target)
+            continue
+        with open(target, 'wb') as f:
+            f.write(body)
+        written.append((encoding, len(body)))
+    return len(data), written
+
+def precompress(path, force=False):
+    total, saved = 0, 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in sorted(filenames):
+            if not name.endswith(EXTENSIONS):
+                continue
+            filename = os.path.join(dirpath, name)
+            size, written = precompress_file(filename, force)
+            for encoding, compressed in written:
+                print('%-60s %8d => %8d %s' % (os.path.relpath(filename, path), size, compressed, encoding))
+                if encoding == 'gzip':
+                    total += size
+                    saved += size - compressed
+    print('gzip: %s bytes => %s bytes' % (total, total - saved))
+
+if __name__ == '__main__':
+    precompress(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'), force='--force' in sys.argv[1:])
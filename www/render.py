@@ -0,0 +1,189 @@
+import asyncio, concurrent.futures, hashlib, json, logging, multiprocessing, threading
+
+import markdown2
+from cache import LRUCache
+from config import configs
+
+_log = logging.getLogger('render')
+
+#markdown渲染 博客正文统一从这里转成html 渲染结果按内容hash缓存 热门文章只需要渲染一次
+#markdown2是纯python的同步代码 大文章放到进程池/线程池里渲染 不阻塞事件循环
+
+_options = configs.markdown
+_extras = list(_options.extras or [])
+_safe_mode = _options.safe_mode
+
+#渲染选项的指纹 和内容hash一起作为缓存的key 选项变了key自然就变了
+def options_signature(extras=None, safe_mode=None):
+    return hashlib.sha1(json.dumps([sorted(extras or []), safe_mode]).encode('utf-8')).hexdigest()[:12]
+
+_signature = options_signature(_extras, _safe_mode)
+
+#按字符串的utf-8字节数记账 比sys.getsizeof更接近真实的内存占用
+def _html_size(html):
+    return len(html.encode('utf-8'))
+
+#渲染版本 markdown2升级或者extras/safe_mode变了 数据库里保存的html就要重新渲染
+RENDER_VERSION = '%s-%s' % (markdown2.__version__, _signature)
+
+#单篇渲染最多用time_budget秒 病态输入超时会抛MarkdownTimeout 执行器的槽位马上就空出来了
+#asyncio.wait_for超时只是不再等结果 渲染还在执行器里跑
+_time_budget = _options.time_budget
+
+#同一组选项的markdown2转换器池 避免每次渲染都新建Markdown对象
+_pool = markdown2.markdown_pool(extras=_extras, safe_mode=_safe_mode, time_budget=_time_budget)
+
+_cache = LRUCache(max_entries=_options.cache.max_entries, max_bytes=_options.cache.max_bytes, sizeof=_html_size)
+
+def _cache_key(content, signature=_signature):
+    return '%s:%s' % (signature, hashlib.sha1(content.encode('utf-8')).hexdigest())
+
+#把文本变成html 渲染超时或者排队太多时也用它降级
+def text2html(text):
+    #每一行的前后空格去掉 然后对每一行加上p标签 &换成&amp <换&lt >换&gt
+    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
+    return ''.join(lines)
+
+#在执行器里跑的渲染函数 进程池要pickle它 所以必须是模块级函数
+def _convert(content):
+    return str(_pool.convert(content))
+
+#渲染执行器 init_executor()之前为None 这时全部在当前线程同步渲染
+_executor = None
+_inline_threshold = 0
+_max_pending = 0
+_timeout = None
+_pending = 0    #已经提交给执行器还没完成的渲染数
+
+def init_executor(kind='process', workers=None, inline_threshold=4096, max_pending=16, timeout=5):
+    global _executor, _inline_threshold, _max_pending, _timeout
+    if kind == 'process':
+        #子进程是第一次提交渲染时才创建的 那时已经有数据库连接池和日志线程了 fork会把它们的锁也复制过去
+        #所以用spawn启动干净的解释器 子进程只需要导入render
+        _executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    elif kind == 'thread':
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError('Invalid markdown executor kind: %s' % kind)
+    _inline_threshold = inline_threshold
+    _max_pending = max_pending
+    _timeout = timeout
+    _log.info('markdown executor: %s(workers=%s) inline_threshold=%s max_pending=%s timeout=%s', kind, workers, inline_threshold, max_pending, timeout)
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+#返回(html, 是否真正用markdown2渲染了) 降级成text2html的结果不进缓存
+async def _render(content):
+    global _pending
+    key = _cache_key(content)
+    html = _cache.get(key)
+    if html is not None:
+        return html, True
+    if _executor is None or len(content) < _inline_threshold:   #短内容直接渲染 比跨进程传数据还快
+        try:
+            html = _convert(content)
+        except markdown2.MarkdownTimeout:
+            _log.warning('markdown渲染超出时间预算(%ss) 降级为纯文本', _time_budget)
+            return text2html(content), False
+    else:
+        if _pending >= _max_pending:
+            _log.warning('markdown渲染排队已满(%s) 降级为纯文本', _pending)
+            return text2html(content), False
+        _pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            html = await asyncio.wait_for(loop.run_in_executor(_executor, _convert, content), _timeout)
+        except asyncio.TimeoutError:
+            #执行器里的任务没法中途取消 只是这次请求不再等它
+            _log.warning('markdown渲染超时(%ss) 降级为纯文本', _timeout)
+            return text2html(content), False
+        except markdown2.MarkdownTimeout:
+            _log.warning('markdown渲染超出时间预算(%ss) 降级为纯文本', _time_budget)
+            return text2html(content), False
+        finally:
+            _pending -= 1
+    _cache.put(key, html)
+    return html, True
+
+#把markdown转成html 先查缓存 没有再交给执行器渲染
+async def render_markdown(content):
+    html, rendered = await _render(content)
+    return html
+
+#同步版本 给脚本用
+def render_markdown_sync(content):
+    key = _cache_key(content)
+    html = _cache.get(key)
+    if html is None:
+        try:
+            html = _convert(content)
+        except markdown2.MarkdownTimeout:
+            _log.warning('markdown渲染超出时间预算(%ss) 降级为纯文本', _time_budget)
+            return text2html(content)
+        _cache.put(key, html)
+    return html
+
+#内容被修改或删除时 把旧内容对应的渲染结果从缓存里去掉
+def invalidate(content):
+    if content:
+        _cache.pop(_cache_key(content))
+
+def cache_stats():
+    return dict(_cache.stats(), pending=_pending)
+
+#写入时渲染 把html和渲染版本一起存到blog上 之后blog.save()/update()会写进数据库
+#降级渲染的结果不打版本号 读的时候和backfill时会重新渲染
+async def render_blog(blog):
+    blog.html_content, rendered = await _render(blog.content)
+    blog.render_version = RENDER_VERSION if rendered else None
+    return blog
+
+#编辑博客用的增量渲染器 按块缓存html 改了一段就只重新转换这一段
+#块缓存在当前进程里 所以放在线程池里跑 同一时间只能有一个线程用它
+#块缓存只在编辑时填充 重启之后(或者刚编辑过链接定义不同的另一篇)第一次编辑还是整篇转换
+_incremental = markdown2.IncrementalMarkdown(extras=_extras, safe_mode=_safe_mode, max_blocks=_options.incremental.max_blocks)
+_incremental_lock = threading.Lock()
+
+#time_budget和执行器的timeout取小的 wait_for超时不再等的时候 线程里的转换也差不多同时停下来
+def _incremental_budget():
+    budgets = [b for b in (_time_budget, _timeout) if b]
+    return min(budgets) if budgets else None
+
+#超出预算返回(None, None) 异常在线程里就处理掉 锁一定会释放 也不会留下没人取的异常
+def _convert_incremental(content, budget):
+    with _incremental_lock:
+        _incremental.time_budget = budget
+        try:
+            html = str(_incremental.convert(content))
+        except markdown2.MarkdownTimeout:
+            return None, None
+        return html, _incremental.last_stats
+
+#博客修改后重新渲染 内容没变直接用缓存 链接定义或脚注变了会自动整篇重新转换
+async def rerender_blog(blog):
+    key = _cache_key(blog.content)
+    html = _cache.get(key)
+    if html is None:
+        loop = asyncio.get_event_loop()
+        try:
+            html, stats = await asyncio.wait_for(loop.run_in_executor(None, _convert_incremental, blog.content, _incremental_budget()), _timeout)
+        except asyncio.TimeoutError:
+            html = None
+        if html is None:
+            _log.warning('markdown增量渲染超时 降级为纯文本')
+            blog.html_content, blog.render_version = text2html(blog.content), None
+            return blog
+        _log.info('增量渲染blog %s: %s', blog.id, stats)
+        _cache.put(key, html)
+    blog.html_content, blog.render_version = html, RENDER_VERSION
+    return blog
+
+#读取时优先用数据库里保存的html 版本不对(还没backfill)才现场渲染
+async def blog_html(blog):
+    if blog.html_content and blog.render_version == RENDER_VERSION:
+        return blog.html_content
+    return await render_markdown(blog.content)
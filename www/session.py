@@ -0,0 +1,95 @@
+import threading, time
+
+from cache import LRUCache
+from config import configs
+
+#登录会话缓存 cookie字符串 => 已经验证过的用户(密码已隐藏)
+#auth_factory每个请求都要解析cookie 命中缓存就不用User.find和算sha1了
+#缓存时间要比cookie的有效期短很多 用户改了密码/权限时调用invalidate_user()让旧的会话重新验证
+
+#进程内的后端 多个worker进程部署时各自一份 可以换成共享的后端(比如redis) 实现下面这几个方法就行:
+#   get(key)                返回缓存的值 过期或没有就返回None
+#   set(key, uid, value, ttl)
+#   delete(key)
+#   delete_user(uid)        删除这个用户的所有会话
+class MemorySessionBackend(object):
+
+    def __init__(self, max_entries=10000):
+        self._cache = LRUCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._keys = {}     #uid => 这个用户的cookie集合 用来按用户删除
+
+    def get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        expires, uid, value = item
+        if expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, uid, value, ttl):
+        with self._lock:
+            self._cache.put(key, (time.time() + ttl, uid, value))
+            keys = self._keys.setdefault(uid, set())
+            keys.add(key)
+            for k in [k for k in keys if k not in self._cache]:    #被LRU淘汰掉的顺便清理
+                keys.discard(k)
+
+    def delete(self, key):
+        item = self._cache.pop(key)
+        if item is not None:
+            with self._lock:
+                keys = self._keys.get(item[1])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._keys[item[1]]
+
+    def delete_user(self, uid):
+        with self._lock:
+            keys = self._keys.pop(uid, ())
+        for key in keys:
+            self._cache.pop(key)
+
+    def stats(self):
+        return dict(self._cache.stats(), users=len(self._keys))
+
+_options = configs.session
+_ttl = _options.cache_ttl
+_backend = MemorySessionBackend(max_entries=_options.cache_size) if _ttl else None
+
+#换成共享的后端 在app启动时调用
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+#返回缓存的用户字典 没有就返回None
+def get(cookie_str):
+    if _backend is None:
+        return None
+    return _backend.get(cookie_str)
+
+#expires是cookie自己的过期时间 缓存不会比cookie活得更久
+def put(cookie_str, uid, user, expires):
+    if _backend is None:
+        return
+    ttl = min(_ttl, expires - time.time())
+    if ttl > 0:
+        _backend.set(cookie_str, uid, dict(user), ttl)
+
+#退出登录
+def invalidate(cookie_str):
+    if _backend is not None and cookie_str:
+        _backend.delete(cookie_str)
+
+#用户改了密码或者管理员权限 他的所有会话都要重新验证
+def invalidate_user(uid):
+    if _backend is not None:
+        _backend.delete_user(uid)
+
+def stats():
+    if _backend is None or not hasattr(_backend, 'stats'):
+        return {}
+    return _backend.stats()